@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+analizza_pesi.py — Scompone il peso dei report in public/gare/ e controlla i budget.
+
+Uso:
+    python generator/analizza_pesi.py                     # tabella + budget di default
+    python generator/analizza_pesi.py --max-report 800    # KB per report
+    python generator/analizza_pesi.py --max-totale 60     # MB per tutto l'archivio
+    python generator/analizza_pesi.py --misura raw        # budget sui byte non compressi
+
+Per ogni report separa:
+  css     <style> inline
+  js      <script> inline, esclusi i dati del blocco autoload
+  gpx     GPX incorporato in base64 (GPX_B64)
+  indice  array precalcolati (window.GPX_INDEX)
+  markup  tutto il resto (HTML e tag dei blocchi inline)
+
+Ogni parte è misurata grezza e compressa (gzip -9, come la servirebbe un CDN);
+la compressione delle parti prese da sole è indicativa, quella del file intero
+è quella reale. I budget si applicano al file intero.
+
+Exit code 0 se tutti i budget sono rispettati, 1 altrimenti.
+"""
+
+import re
+import sys
+import zlib
+import argparse
+from pathlib import Path
+
+ARCHIVIO_DIR = Path(__file__).parent.parent
+HTML_DIR     = ARCHIVIO_DIR / 'public' / 'gare'
+
+BUDGET_REPORT_KB = 1024    # per report (gzip)
+BUDGET_TOTALE_MB = 100     # tutto l'archivio (gzip)
+
+PARTI = ('css', 'js', 'gpx', 'indice', 'markup')
+
+STYLE_RE  = re.compile(r'<style[^>]*>(.*?)</style>', re.DOTALL | re.IGNORECASE)
+SCRIPT_RE = re.compile(r'<script(?![^>]*\bsrc=)[^>]*>(.*?)</script>', re.DOTALL | re.IGNORECASE)
+GPX_RE    = re.compile(r'var GPX_B64 = "([^"]*)"')
+INDICE_RE = re.compile(r'window\.GPX_INDEX = (\{.*?\});')
+
+
+def gzip_size(data: bytes) -> int:
+    """Byte dopo la compressione gzip -9 (header e trailer gzip inclusi)."""
+    if not data:
+        return 0
+    c = zlib.compressobj(9, zlib.DEFLATED, 31)
+    return len(c.compress(data) + c.flush())
+
+
+# ── ANALISI ───────────────────────────────────────────────────────────────────
+
+def split_report(html: str) -> dict[str, str]:
+    """Testo di ogni parte del report (le parti assenti sono stringhe vuote)."""
+    gpx = ''.join(m.group(1) for m in GPX_RE.finditer(html))
+    indice = ''.join(m.group(1) for m in INDICE_RE.finditer(html))
+    css = ''.join(m.group(1) for m in STYLE_RE.finditer(html))
+    js_parts = []
+    for m in SCRIPT_RE.finditer(html):
+        body = GPX_RE.sub('var GPX_B64 = ""', m.group(1))
+        js_parts.append(INDICE_RE.sub('window.GPX_INDEX = {};', body))
+    js = ''.join(js_parts)
+
+    # Il markup è il file con i corpi di <style> e <script> inline svuotati
+    markup = STYLE_RE.sub(lambda m: m.group(0)[:m.start(1) - m.start(0)] + '</style>', html)
+    markup = SCRIPT_RE.sub(lambda m: m.group(0)[:m.start(1) - m.start(0)] + '</script>', markup)
+    return {'css': css, 'js': js, 'gpx': gpx, 'indice': indice, 'markup': markup}
+
+
+def analyze_report(path: Path) -> dict:
+    """{'raw': {parte: byte}, 'gz': {parte: byte}, 'file_raw': .., 'file_gz': ..}"""
+    data = path.read_bytes()
+    parts = split_report(data.decode('utf-8', errors='replace'))
+    raw, gz = {}, {}
+    for name in PARTI:
+        encoded = parts[name].encode('utf-8')
+        raw[name] = len(encoded)
+        gz[name] = gzip_size(encoded)
+    return {'raw': raw, 'gz': gz, 'file_raw': len(data), 'file_gz': gzip_size(data)}
+
+
+# ── STAMPA ────────────────────────────────────────────────────────────────────
+
+def fmt_kb(n: int) -> str:
+    return f"{n / 1024:,.1f}"
+
+
+def print_table(results: dict[str, dict]):
+    """Una riga per report: KB grezzi/gzip per ogni parte e per il file."""
+    name_w = max([len(s) for s in results] + [len('TOTALE')])
+    header = f"  {'report':<{name_w}}" + ''.join(f" {p:>17}" for p in PARTI) + f" {'file':>17}"
+    print(header)
+    print(f"  {'':<{name_w}}" + ''.join(f" {'KB raw / gzip':>17}" for _ in range(len(PARTI) + 1)))
+
+    def row(label, r):
+        cells = ''.join(f" {fmt_kb(r['raw'][p]) + ' / ' + fmt_kb(r['gz'][p]):>17}" for p in PARTI)
+        file_cell = fmt_kb(r['file_raw']) + ' / ' + fmt_kb(r['file_gz'])
+        print(f"  {label:<{name_w}}{cells} {file_cell:>17}")
+
+    for slug, r in sorted(results.items()):
+        row(slug, r)
+    print("  " + "─" * (len(header) - 2))
+    row('TOTALE', totals(results))
+
+
+def totals(results: dict[str, dict]) -> dict:
+    tot = {'raw': dict.fromkeys(PARTI, 0), 'gz': dict.fromkeys(PARTI, 0), 'file_raw': 0, 'file_gz': 0}
+    for r in results.values():
+        for p in PARTI:
+            tot['raw'][p] += r['raw'][p]
+            tot['gz'][p] += r['gz'][p]
+        tot['file_raw'] += r['file_raw']
+        tot['file_gz'] += r['file_gz']
+    return tot
+
+
+# ── MAIN ──────────────────────────────────────────────────────────────────────
+
+def main():
+    parser = argparse.ArgumentParser(description='Peso dei report per componente, con budget')
+    parser.add_argument('--max-report', type=float, default=BUDGET_REPORT_KB,
+                        help=f'budget per report in KB (default: {BUDGET_REPORT_KB})')
+    parser.add_argument('--max-totale', type=float, default=BUDGET_TOTALE_MB,
+                        help=f"budget dell'archivio in MB (default: {BUDGET_TOTALE_MB})")
+    parser.add_argument('--misura', choices=('gzip', 'raw'), default='gzip',
+                        help='byte su cui applicare i budget (default: gzip)')
+    args = parser.parse_args()
+
+    if not HTML_DIR.exists():
+        print(f"[FAIL] Cartella report non trovata: {HTML_DIR}")
+        return 1
+
+    paths = sorted(HTML_DIR.glob('*.html'))
+    print(f"[*] Analisi di {len(paths)} report in {HTML_DIR}...\n")
+    results = {p.stem: analyze_report(p) for p in paths}
+    if results:
+        print_table(results)
+
+    key = 'file_gz' if args.misura == 'gzip' else 'file_raw'
+    limit_report = args.max_report * 1024
+    limit_total = args.max_totale * 1024 * 1024
+    failed = 0
+    print()
+    for slug, r in sorted(results.items()):
+        if r[key] > limit_report:
+            print(f"  [FAIL] {slug}: {fmt_kb(r[key])} KB > {args.max_report:g} KB ({args.misura})")
+            failed += 1
+    total = sum(r[key] for r in results.values())
+    if total > limit_total:
+        print(f"  [FAIL] archivio: {total / 1024 / 1024:.2f} MB > {args.max_totale:g} MB ({args.misura})")
+        failed += 1
+
+    if failed:
+        print(f"\n[*] Risultato: {failed} budget superati")
+        return 1
+    print(f"[OK] Budget rispettati ({args.misura}): max {args.max_report:g} KB per report, "
+          f"{total / 1024 / 1024:.2f}/{args.max_totale:g} MB totali")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
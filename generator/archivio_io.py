@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+archivio_io.py — Scritture atomiche e lock dell'archivio, condivisi dagli script del generatore.
+
+Ogni file dell'archivio (GPX, JSON, report, cache, tile) va scritto con le
+funzioni di questo modulo: il contenuto finisce in un file temporaneo nella
+stessa cartella e prende il posto di quello vecchio con un rename atomico,
+così un lettore vede sempre la versione precedente o quella nuova, mai un file
+a metà. Con skip_unchanged=True un contenuto identico a quello già su disco non
+viene riscritto: il file resta lo stesso (anche la data di modifica), così le
+build ripetute non toccano ciò che non è cambiato.
+
+Il lock dell'archivio (.cache/archivio.lock) serializza le operazioni che
+devono vedere JSON, GPX e report coerenti tra loro: l'aggiunta di una gara,
+la rigenerazione di un report, la modifica dei JSON. È un lock tra processi
+(fcntl su Linux/macOS, msvcrt su Windows) ed è rientrante nello stesso processo.
+
+Uso:
+    from archivio_io import archive_lock, reserve_slug, write_text_atomic
+
+    with reserve_slug(slug) as json_path:      # SlugTakenError se esiste già
+        write_text_atomic(json_path, testo)
+"""
+
+import os
+import time
+import shutil
+import filecmp
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:     # Windows
+    fcntl = None
+    import msvcrt
+
+ARCHIVIO_DIR = Path(__file__).parent.parent
+JSON_DIR     = ARCHIVIO_DIR / 'gare-sorgenti'
+LOCK_PATH    = ARCHIVIO_DIR / '.cache' / 'archivio.lock'
+
+LOCK_POLL_S = 0.1      # intervallo di riprova quando il lock ha un timeout
+
+_new_file_mode = None   # permessi di un file nuovo creato da open(), vedi _default_mode()
+
+
+class SlugTakenError(Exception):
+    """Lo slug è già usato da una gara dell'archivio."""
+
+    def __init__(self, slug):
+        super().__init__(f"esiste già una gara con slug '{slug}'")
+        self.slug = slug
+
+    def __reduce__(self):       # arriva intatta dai worker di un pool di processi
+        return SlugTakenError, (self.slug,)
+
+
+# ── SCRITTURE ATOMICHE ────────────────────────────────────────────────────────
+
+def _same_content(path: Path, data: bytes) -> bool:
+    """True se `path` esiste e contiene esattamente `data`."""
+    try:
+        if os.path.getsize(path) != len(data):
+            return False
+        with open(path, 'rb') as f:
+            return f.read() == data
+    except OSError:
+        return False
+
+
+def _default_mode(directory: Path) -> int:
+    """
+    Permessi che open() darebbe a un file nuovo (0666 meno la umask): mkstemp
+    crea i temporanei con 0600. Letti una volta da un file di prova, senza
+    cambiare la umask del processo (os.umask la toglierebbe a tutti i thread).
+    """
+    global _new_file_mode
+    if _new_file_mode is None:
+        probe = directory / f'.umask-{os.getpid()}-{threading.get_ident()}.tmp'
+        fd = os.open(probe, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        try:
+            _new_file_mode = os.fstat(fd).st_mode & 0o777
+        finally:
+            os.close(fd)
+            os.unlink(probe)
+    return _new_file_mode
+
+
+@contextmanager
+def atomic_open(path: Path, mode: str = 'w', encoding: str | None = 'utf-8',
+                skip_unchanged: bool = False):
+    """
+    Come open(path, mode), ma il file compare solo alla chiusura senza errori.
+    Se il blocco solleva, il temporaneo viene eliminato e `path` resta intatto.
+    Con `skip_unchanged`, se il contenuto scritto è identico a quello di `path`
+    il temporaneo viene scartato e `path` non viene toccato.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        file_mode = os.stat(path).st_mode & 0o777
+    except FileNotFoundError:
+        file_mode = _default_mode(path.parent)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.', suffix='.tmp')
+    try:
+        os.chmod(tmp, file_mode)
+        # newline='': niente \r\n su Windows, stessi byte su ogni sistema
+        text = 'b' not in mode
+        with os.fdopen(fd, mode, encoding=encoding if text else None,
+                       newline='' if text else None) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        if skip_unchanged and path.exists() and filecmp.cmp(tmp, path, shallow=False):
+            os.unlink(tmp)
+        else:
+            os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def write_text_atomic(path: Path, text: str, encoding: str = 'utf-8',
+                      skip_unchanged: bool = False) -> bool:
+    """Scrive `text`; ritorna False se il file era già identico (solo con skip_unchanged)."""
+    return write_bytes_atomic(path, text.encode(encoding), skip_unchanged)
+
+
+def write_bytes_atomic(path: Path, data: bytes, skip_unchanged: bool = False) -> bool:
+    """Scrive `data`; ritorna False se il file era già identico (solo con skip_unchanged)."""
+    if skip_unchanged and _same_content(path, data):
+        return False
+    with atomic_open(path, 'wb') as f:
+        f.write(data)
+    return True
+
+
+def copy_atomic(src: Path, dst: Path):
+    """Come shutil.copy2, ma dst viene sostituito in un colpo solo."""
+    with open(src, 'rb') as fsrc, atomic_open(dst, 'wb') as fdst:
+        shutil.copyfileobj(fsrc, fdst)
+    shutil.copystat(src, dst)
+
+
+# ── LOCK DELL'ARCHIVIO ────────────────────────────────────────────────────────
+
+_thread_lock = threading.RLock()    # serializza i thread dello stesso processo
+_depth = 0                          # livelli di archive_lock() annidati
+_lock_file = None
+
+
+def _try_lock(f) -> bool:
+    try:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock(f):
+    if fcntl:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _acquire_file_lock(timeout: float | None, path: Path = LOCK_PATH):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    f = open(path, 'a+b')
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while not _try_lock(f):
+        if deadline is not None and time.monotonic() >= deadline:
+            f.close()
+            raise TimeoutError(f"file occupato da un altro processo ({path})")
+        time.sleep(LOCK_POLL_S)
+    return f
+
+
+@contextmanager
+def archive_lock(timeout: float | None = None):
+    """
+    Lock esclusivo sull'archivio, tra processi e tra thread.
+    Annidabile: solo il livello più esterno prende e rilascia il lock su file.
+    Con `timeout` (secondi) solleva TimeoutError se non si ottiene in tempo.
+    """
+    global _depth, _lock_file
+    if not _thread_lock.acquire(timeout=-1 if timeout is None else timeout):
+        raise TimeoutError("archivio occupato da un altro thread")
+    try:
+        if _depth == 0:
+            _lock_file = _acquire_file_lock(timeout)
+        _depth += 1
+        try:
+            yield
+        finally:
+            _depth -= 1
+            if _depth == 0:
+                _unlock(_lock_file)
+                _lock_file.close()
+                _lock_file = None
+    finally:
+        _thread_lock.release()
+
+
+@contextmanager
+def file_lock(path: Path, timeout: float | None = None):
+    """
+    Lock esclusivo tra processi su un file qualsiasi (creato se manca), per
+    risorse condivise diverse dall'archivio. Restituisce il file aperto in
+    'a+b': chi lo tiene può leggerne e riscriverne il contenuto. Non rientrante.
+    """
+    f = _acquire_file_lock(timeout, path)
+    try:
+        yield f
+    finally:
+        _unlock(f)
+        f.close()
+
+
+@contextmanager
+def reserve_slug(slug: str, overwrite: bool = False, json_dir: Path = JSON_DIR):
+    """
+    Riserva uno slug per tutta la durata del blocco, sotto il lock dell'archivio.
+    Solleva SlugTakenError se gare-sorgenti/<slug>.json esiste già e `overwrite`
+    è False. Il blocco riceve il percorso del JSON e deve scrivere la gara
+    prima di uscire: finché il lock è tenuto, nessun altro può occupare lo slug.
+    """
+    json_path = json_dir / f"{slug}.json"
+    with archive_lock():
+        if json_path.exists() and not overwrite:
+            raise SlugTakenError(slug)
+        yield json_path
@@ -1,15 +1,31 @@
 #!/usr/bin/env python3
 """
 build_all_reports.py — Genera tutti gli HTML dalle gare JSON esistenti.
-Usa i metadati JSON per riempire i report senza richiedere i GPX originali.
+
+Uso:
+    python generator/build_all_reports.py                 # tutto l'archivio
+    python generator/build_all_reports.py --recupera-gpx  # estrae i GPX mancanti dai report
+
+Per ogni gare-sorgenti/<slug>.json:
+  - se c'è public/gpx/<slug>.gpx → report completo, rigenerato sempre
+    (stesso parsing e stessi dati precalcolati di genera_report.py)
+  - altrimenti → report "stub" senza percorso, solo se l'HTML non esiste già
+
+Non richiede interfaccia grafica: gira anche in CI ad ogni deploy.
 """
 
+import io
 import sys
+import html as html_lib
 import json
 import base64
 import re
+import argparse
 from pathlib import Path
 
+from cache_tracce import cached_track
+from archivio_io import archive_lock, atomic_open, write_bytes_atomic, write_text_atomic
+
 # Cartella dell'archivio
 ARCHIVIO_DIR = Path(__file__).parent.parent
 
@@ -29,11 +45,38 @@ TITLE_HTML = """<div id="report-title-bar" style="
 AUTOLOAD_TEMPLATE = """<!--GPXREPORT_START-->
 <script>
 (function(){{
-    console.log('Report stub loaded: {title}');
+    console.log('Report stub loaded:', {title});
 }})();
 </script>
 <!--GPXREPORT_END-->"""
 
+# Blocco autoload del report completo, scritto a pezzi: tra HEAD e MID va il
+# GPX in base64, tra MID e TAIL l'oggetto GPX_INDEX.
+GPX_AUTOLOAD_HEAD = """<!--GPXREPORT_START-->
+<script>
+(function(){
+    var GPX_B64 = \""""
+GPX_AUTOLOAD_MID = """";
+    var GPX_NAME = {gpx_name};
+    window.GPX_INDEX = """
+GPX_AUTOLOAD_TAIL = """;
+    window._gpxFileName = GPX_NAME;
+    if (typeof loadGPX === 'function') loadGPX({ b64: GPX_B64 });
+})();
+</script>
+<!--GPXREPORT_END-->"""
+
+# Segnaposto inseriti da prepare_template() e sostituiti in scrittura
+_TITLE_MARK    = '\x00TITOLO\x00'
+_AUTOLOAD_MARK = '\x00AUTOLOAD\x00'
+
+B64_CHUNK = 3 * 64 * 1024     # multiplo di 3: i pezzi base64 si concatenano senza padding
+NUM_CHUNK = 4096              # numeri per ogni write() degli array precalcolati
+
+# Risoluzioni (punti) dei profili LTTB per il grafico altimetrico; il template
+# sceglie la più grossolana con abbastanza punti nella finestra visibile
+PROFILO_LIVELLI = (500, 2000, 8000)
+
 
 def find_template(template_path):
     """Cerca il template index.html"""
@@ -42,6 +85,161 @@ def find_template(template_path):
     return None
 
 
+def prepare_template(template_html):
+    """
+    Adatta il template per la pubblicazione, una volta sola per build.
+    Ritorna la lista di pezzi del report: testo fisso alternato ai segnaposto
+    di titolo e autoload, che write_report() riempie gara per gara.
+    """
+    html = template_html
+    
+    # Rimuovi vecchio autoload se esiste
+    html = re.sub(r'<!--GPXREPORT_START-->.*?<!--GPXREPORT_END-->', '', html, flags=re.DOTALL)
+    
+    # Sostituisci il titolo
+    html = re.sub(r'<title>[^<]*</title>', f'<title>{_TITLE_MARK}</title>', html)
+    
+    # Mostra data-content
+    html = re.sub(r'(#data-content\s*\{[^}]*)display\s*:\s*none', r'\1display: block', html)
+    
+    # Nascondi upload-section
+    html = re.sub(r'(<div id="upload-section")([^>]*)>', r'\1\2 style="display:none!important">', html)
+    
+    # Rimuovi reset-bar
+    html = re.sub(r'<div id="reset-bar".*?</div>', '', html, flags=re.DOTALL)
+    html = html.replace("if (rb) rb.style.display = 'flex';", "// report: reset-bar rimosso")
+    html = html.replace("document.getElementById('reset-bar').style.display = 'none';", "// report: reset-bar rimosso")
+    
+    # Nascondi sv-hint
+    html = re.sub(r'(<p class="sv-hint")', r'\1 style="display:none"', html)
+    
+    # Aggiungi title bar
+    html = html.replace('<div class="container">', '<div class="container">\n' + TITLE_HTML.format(title=_TITLE_MARK), 1)
+    
+    # Punto di inserimento dell'autoload
+    html = html.replace('</body>', _AUTOLOAD_MARK + '\n</body>', 1)
+    
+    return re.split(f'({_TITLE_MARK}|{_AUTOLOAD_MARK})', html)
+
+
+def write_report(f, parts, title, write_autoload):
+    """
+    Scrive il report sul file aperto f; write_autoload(f) scrive il blocco autoload.
+    Il titolo arriva dai metadati (anche dal servizio di ingest): va sempre escapato.
+    """
+    title = html_lib.escape(title)
+    for part in parts:
+        if part == _TITLE_MARK:
+            f.write(title)
+        elif part == _AUTOLOAD_MARK:
+            write_autoload(f)
+        else:
+            f.write(part)
+
+
+def js_string(text):
+    """Stringa JS letterale sicura dentro <script> (niente </script> né <!--)."""
+    return json.dumps(text, ensure_ascii=False).replace('<', '\\u003c')
+
+
+def render_report(template_html, title, autoload):
+    """Report completo come stringa (usato per gli stub, che sono piccoli)."""
+    out = io.StringIO()
+    write_report(out, prepare_template(template_html), title, lambda f: f.write(autoload))
+    return out.getvalue()
+
+
+def report_fields(track):
+    """Array precalcolati dal generatore che il report legge da window.GPX_INDEX."""
+    index = track.range_index()
+    run_start, run_class = track.gradient_runs()
+    # Livelli concatenati in un solo array; lttb_n ne dà le lunghezze
+    levels = [track.lttb(t) for t in PROFILO_LIVELLI if t < len(track)]
+    return [
+        ('dist', index['dist'], 1),
+        ('gain', index['gain'], 1),
+        ('loss', index['loss'], 1),
+        ('ele',  index['ele'],  1),
+        ('run_start', run_start, None),
+        ('run_class', run_class, None),
+        ('lttb_n', [len(level) for level in levels], None),
+        ('lttb', (i for level in levels for i in level), None),
+    ]
+
+
+def write_report_data(f, track):
+    """Scrive GPX_INDEX come JSON compatto, a blocchi, senza costruirlo in memoria."""
+    f.write('{"n":%d' % len(track))
+    for name, values, ndigits in report_fields(track):
+        f.write(f',"{name}":[')
+        batch = []
+        first = True
+        for v in values:
+            batch.append(repr(round(v, ndigits)) if ndigits is not None else str(v))
+            if len(batch) == NUM_CHUNK:
+                f.write(('' if first else ',') + ','.join(batch))
+                batch.clear()
+                first = False
+        if batch:
+            f.write(('' if first else ',') + ','.join(batch))
+        f.write(']')
+    f.write('}')
+
+
+def write_gpx_autoload(f, gpx_path, track):
+    """Blocco autoload con il GPX in base64 (codificato a pezzi) e gli indici precalcolati."""
+    f.write(GPX_AUTOLOAD_HEAD)
+    with open(gpx_path, 'rb') as src:
+        while chunk := src.read(B64_CHUNK):
+            f.write(base64.b64encode(chunk).decode('ascii'))
+    f.write(GPX_AUTOLOAD_MID.format(gpx_name=json.dumps(Path(gpx_path).name)))
+    write_report_data(f, track)
+    f.write(GPX_AUTOLOAD_TAIL)
+
+
+def generate_full_report(gpx_path, title, template, output_html_path, track=None):
+    """
+    Genera il report completo di una gara a partire dal suo GPX.
+    `template` è l'HTML del template o il risultato di prepare_template():
+    in una build conviene preparare il template una volta sola.
+    Il report viene scritto in streaming: GPX, base64 e HTML non stanno mai
+    interi in memoria. Il file compare solo a scrittura completata; se è
+    identico a quello esistente resta quello vecchio, data di modifica compresa
+    (l'output dipende solo da template, titolo e GPX: niente date né ordini variabili).
+    """
+    parts = prepare_template(template) if isinstance(template, str) else template
+    if track is None:
+        track = cached_track(gpx_path)
+    with atomic_open(output_html_path, skip_unchanged=True) as f:
+        write_report(f, parts, title, lambda out: write_gpx_autoload(out, gpx_path, track))
+
+
+def generate_report_from_gpx(gara_json_path, gpx_path, template, output_html_path):
+    """Genera (sovrascrivendo) il report completo di una gara dal suo GPX archiviato."""
+    try:
+        with open(gara_json_path, 'r', encoding='utf-8') as f:
+            gara = json.load(f)
+        title = gara.get('titolo', 'Report')
+        generate_full_report(gpx_path, title, template, output_html_path)
+        return True
+    except Exception as e:
+        print(f"  [FAIL] {gpx_path.name}: {e}")
+        return False
+
+
+def recover_gpx_from_report(html_path, gpx_path):
+    """
+    Estrae il GPX incorporato (GPX_B64) da un report esistente.
+    Serve per i report generati prima che i GPX venissero archiviati in public/gpx/.
+    """
+    html = html_path.read_text(encoding='utf-8')
+    m = re.search(r'var GPX_B64 = "([A-Za-z0-9+/=]+)"', html)
+    if not m:
+        return False
+    write_bytes_atomic(gpx_path, base64.b64decode(m.group(1)))
+    return True
+
+
 def generate_report_from_json(gara_json_path, template_html, output_html_path):
     """
     Genera un HTML di report stub da un JSON di gara SOLO se il file non esiste.
@@ -59,40 +257,10 @@ def generate_report_from_json(gara_json_path, template_html, output_html_path):
         # Usa il titolo dal JSON
         title = gara.get('titolo', 'Report')
         
-        # Leggi il template
-        html = template_html
-        
-        # Rimuovi vecchio autoload se esiste
-        html = re.sub(r'<!--GPXREPORT_START-->.*?<!--GPXREPORT_END-->', '', html, flags=re.DOTALL)
-        
-        # Sostituisci il titolo
-        html = re.sub(r'<title>[^<]*</title>', f'<title>{title}</title>', html)
-        
-        # Mostra data-content
-        html = re.sub(r'(#data-content\s*\{[^}]*)display\s*:\s*none', r'\1display: block', html)
-        
-        # Nascondi upload-section
-        html = re.sub(r'(<div id="upload-section")([^>]*)>', r'\1\2 style="display:none!important">', html)
-        
-        # Rimuovi reset-bar
-        html = re.sub(r'<div id="reset-bar".*?</div>', '', html, flags=re.DOTALL)
-        html = html.replace("if (rb) rb.style.display = 'flex';", "// report: reset-bar rimosso")
-        html = html.replace("document.getElementById('reset-bar').style.display = 'none';", "// report: reset-bar rimosso")
-        
-        # Nascondi sv-hint
-        html = re.sub(r'(<p class="sv-hint")', r'\1 style="display:none"', html)
-        
-        # Aggiungi title bar
-        html = html.replace('<div class="container">', '<div class="container">\n' + TITLE_HTML.format(title=title), 1)
-        
-        # Aggiungi stub autoload
-        autoload = AUTOLOAD_TEMPLATE.format(title=title)
-        html = html.replace('</body>', autoload + '\n</body>', 1)
+        html = render_report(template_html, title, AUTOLOAD_TEMPLATE.format(title=js_string(title)))
         
         # Salva l'HTML
-        output_html_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(output_html_path, 'w', encoding='utf-8') as f:
-            f.write(html)
+        write_text_atomic(output_html_path, html)
         
         return True
     except Exception as e:
@@ -101,9 +269,14 @@ def generate_report_from_json(gara_json_path, template_html, output_html_path):
 
 
 def main():
-    """Genera tutti i report HTML dai JSON"""
+    """Genera tutti i report HTML dai JSON (e dai GPX archiviati)"""
+    parser = argparse.ArgumentParser(description='Rigenera tutti i report HTML')
+    parser.add_argument('--recupera-gpx', action='store_true',
+                        help='estrae in public/gpx/ i GPX incorporati nei report esistenti')
+    args = parser.parse_args()
     
     json_dir = ARCHIVIO_DIR / 'gare-sorgenti'
+    gpx_dir = ARCHIVIO_DIR / 'public' / 'gpx'
     # Genera i file in public/ così Astro li copia automaticamente in dist/
     html_dir = ARCHIVIO_DIR / 'public' / 'gare'
     template_path = Path(__file__).parent / 'index.html'
@@ -116,9 +289,10 @@ def main():
         print(f"[FAIL] Template non trovato: {template_path}")
         sys.exit(1)
     
-    # Leggi il template una sola volta
+    # Leggi e prepara il template una sola volta
     with open(template_path, 'r', encoding='utf-8') as f:
         template_html = f.read()
+    template_parts = prepare_template(template_html)
     
     # Trova tutti i JSON
     json_files = list(json_dir.glob('*.json'))
@@ -133,9 +307,23 @@ def main():
     for json_file in sorted(json_files):
         slug = json_file.stem
         output_file = html_dir / f"{slug}.html"
+        gpx_file = gpx_dir / f"{slug}.gpx"
+        
+        # Un'importazione in corso non può cambiare JSON e GPX a metà report
+        with archive_lock():
+            if args.recupera_gpx and not gpx_file.exists() and output_file.exists():
+                if recover_gpx_from_report(output_file, gpx_file):
+                    print(f"  [*] {slug}: GPX recuperato dal report esistente")
+        
+            if gpx_file.exists():
+                ok = generate_report_from_gpx(json_file, gpx_file, template_parts, output_file)
+                kind = "completo"
+            else:
+                kind = "esistente" if output_file.exists() else "stub"
+                ok = generate_report_from_json(json_file, template_html, output_file)
         
-        if generate_report_from_json(json_file, template_html, output_file):
-            print(f"  [OK] {slug}")
+        if ok:
+            print(f"  [OK] {slug} ({kind})")
             success += 1
         else:
             print(f"  [FAIL] {slug}")
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+cache_tracce.py — Cache persistente delle tracce GPX già lette, per hash del contenuto.
+
+Ogni GPX letto una volta viene salvato in .cache/tracce/ come colonne binarie
+lat/lon/ele più il riepilogo di RouteTrack.analyze(): le letture successive
+dello stesso file (anche rinominato o copiato) saltano del tutto il parsing XML.
+La chiave è l'sha256 del file insieme ad ANALYSIS_VERSION, quindi cambiare il
+calcolo dell'analisi invalida da sé le voci vecchie.
+
+Formato di una voce (<sha256>-v<ANALYSIS_VERSION>.trk):
+    riga JSON {"n": punti, "analisi": {...}}
+    n double little-endian di lat, poi di lon, poi di ele
+
+Le voci sono scritte con archivio_io (rename atomico), quindi i lettori
+concorrenti vedono una voce intera o nessuna. Lo spazio occupato è limitato a
+CACHE_MAX_MB: un hit aggiorna la data di modifica della voce e, quando si
+supera il limite, vengono eliminate le voci usate meno di recente (LRU).
+
+Uso:
+    from cache_tracce import cached_track, cached_analysis
+
+    track = cached_track(gpx_path)          # RouteTrack, analyze() già pronto
+    cached_analysis(gpx_path).as_dict()     # solo il riepilogo, senza colonne
+
+    python generator/cache_tracce.py            # stato della cache
+    python generator/cache_tracce.py --svuota   # elimina tutte le voci
+"""
+
+import os
+import sys
+import json
+import hashlib
+import argparse
+from array import array
+from pathlib import Path
+
+from traccia import RouteTrack, RouteAnalysis, ANALYSIS_VERSION
+from archivio_io import atomic_open
+
+ARCHIVIO_DIR = Path(__file__).parent.parent
+CACHE_DIR    = ARCHIVIO_DIR / '.cache' / 'tracce'
+
+CACHE_MAX_MB = 64          # oltre questo si eliminano le voci meno usate
+CACHE_RESIDUO = 0.8        # dopo lo sfoltimento la cache occupa al più l'80% del limite
+HASH_CHUNK = 1024 * 1024   # byte letti per volta per calcolare l'hash
+
+
+def file_digest(path: Path) -> str:
+    """sha256 esadecimale del contenuto del file."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_CHUNK), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def entry_path(digest: str) -> Path:
+    return CACHE_DIR / f"{digest}-v{ANALYSIS_VERSION}.trk"
+
+
+# ── LETTURA ───────────────────────────────────────────────────────────────────
+
+def _touch(path: Path):
+    """Segna la voce come usata ora (la data di modifica fa da orologio LRU)."""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def _read_entry(path: Path, with_columns: bool) -> tuple[dict, RouteTrack | None] | None:
+    """(header, traccia) dalla voce, None se manca o non è valida."""
+    try:
+        with open(path, 'rb') as f:
+            header = json.loads(f.readline())
+            n = int(header['n'])
+            if not with_columns:
+                return header, None
+            cols = []
+            for _ in range(3):
+                col = array('d')
+                col.frombytes(f.read(n * col.itemsize))
+                if len(col) != n:
+                    return None
+                if sys.byteorder != 'little':
+                    col.byteswap()
+                cols.append(col)
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    return header, RouteTrack(*cols)
+
+
+def _analysis(header: dict) -> RouteAnalysis:
+    return RouteAnalysis(**header['analisi'])
+
+
+def cached_track(gpx_path: Path, digest: str | None = None) -> RouteTrack:
+    """
+    RouteTrack del GPX, dalla cache se il contenuto è già stato letto.
+    `digest` evita di ricalcolare l'hash se il chiamante lo ha già.
+    Il riepilogo di analyze() è già impostato sulla traccia restituita.
+    """
+    digest = digest or file_digest(gpx_path)
+    path = entry_path(digest)
+    entry = _read_entry(path, with_columns=True)
+    if entry:
+        header, track = entry
+        track.set_analysis(_analysis(header))
+        _touch(path)
+        return track
+    track = RouteTrack.from_gpx(gpx_path)
+    store(digest, track)
+    return track
+
+
+def cached_analysis(gpx_path: Path, digest: str | None = None) -> RouteAnalysis:
+    """Riepilogo del GPX: a cache calda legge solo la prima riga della voce."""
+    digest = digest or file_digest(gpx_path)
+    path = entry_path(digest)
+    entry = _read_entry(path, with_columns=False)
+    if entry:
+        _touch(path)
+        return _analysis(entry[0])
+    return cached_track(gpx_path, digest).analyze()
+
+
+# ── SCRITTURA E SFOLTIMENTO ───────────────────────────────────────────────────
+
+def store(digest: str, track: RouteTrack):
+    """Salva traccia e riepilogo, poi riporta la cache entro il limite."""
+    header = {'n': len(track), 'analisi': track.analyze().as_dict()}
+    with atomic_open(entry_path(digest), 'wb') as f:
+        f.write(json.dumps(header, sort_keys=True).encode('utf-8') + b'\n')
+        for col in (track.lat, track.lon, track.ele):
+            if sys.byteorder != 'little':
+                col = array('d', col)
+                col.byteswap()
+            f.write(col.tobytes())
+    prune()
+
+
+def _entries() -> list[tuple[float, int, Path]]:
+    """(mtime, byte, percorso) delle voci presenti."""
+    out = []
+    for p in CACHE_DIR.glob('*.trk') if CACHE_DIR.exists() else ():
+        try:
+            st = p.stat()
+        except FileNotFoundError:     # eliminata da un altro processo
+            continue
+        out.append((st.st_mtime, st.st_size, p))
+    return out
+
+
+def prune(max_bytes: int | None = None) -> int:
+    """
+    Elimina le voci meno usate finché la cache supera il limite, e quelle di
+    altre ANALYSIS_VERSION. Ritorna il numero di voci eliminate.
+    """
+    limit = CACHE_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+    entries = _entries()
+    suffix = f"-v{ANALYSIS_VERSION}.trk"
+    stale = [e for e in entries if not e[2].name.endswith(suffix)]
+    live = sorted(e for e in entries if e[2].name.endswith(suffix))
+    total = sum(size for _, size, _ in live)
+    victims = stale
+    if total > limit:
+        target = limit * CACHE_RESIDUO
+        for entry in live:
+            if total <= target:
+                break
+            victims.append(entry)
+            total -= entry[1]
+    removed = 0
+    for _, _, p in victims:
+        try:
+            p.unlink()
+            removed += 1
+        except OSError:               # già eliminata, o aperta altrove (Windows)
+            pass
+    return removed
+
+
+# ── MAIN ──────────────────────────────────────────────────────────────────────
+
+def main():
+    parser = argparse.ArgumentParser(description='Stato e pulizia della cache delle tracce GPX')
+    parser.add_argument('--svuota', action='store_true', help='elimina tutte le voci')
+    args = parser.parse_args()
+
+    if args.svuota:
+        n = prune(max_bytes=0)
+        print(f"[OK] {n} voci eliminate da {CACHE_DIR}")
+        return 0
+
+    entries = _entries()
+    total = sum(size for _, size, _ in entries)
+    print(f"[*] {CACHE_DIR}")
+    print(f"    {len(entries)} voci, {total / 1024 / 1024:.2f}/{CACHE_MAX_MB} MB, "
+          f"ANALYSIS_VERSION {ANALYSIS_VERSION}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+genera_anteprime.py — Miniature SVG (forma del percorso + profilo) per le card.
+
+Per ogni public/gpx/*.gpx scrive public/anteprime/<slug>.svg: a sinistra il
+tracciato proiettato e semplificato (Douglas-Peucker in pixel), a destra il
+profilo altimetrico ridotto a pochi punti (LTTB). Ogni miniatura pesa poche
+centinaia di byte, così la pagina indice può mostrarne centinaia senza
+caricare Leaflet, d3 o il GPX.
+
+Uso:
+    python generator/genera_anteprime.py              # solo GPX nuovi o modificati
+    python generator/genera_anteprime.py --completo   # rigenera tutto
+
+Incrementale: l'hash di ogni GPX è salvato in .cache/anteprime.json, una
+miniatura viene ridisegnata solo se il suo GPX cambia. public/anteprime/indice.json
+associa a ogni slug le prime cifre dell'hash, usate dalle card come versione
+nell'URL (?v=...), così il browser non tiene in cache una miniatura vecchia.
+"""
+
+import sys
+import json
+import math
+import hashlib
+import argparse
+from pathlib import Path
+
+from traccia import RouteTrack
+from cache_tracce import cached_track
+from archivio_io import write_text_atomic
+
+ARCHIVIO_DIR   = Path(__file__).parent.parent
+GPX_DIR        = ARCHIVIO_DIR / 'public' / 'gpx'
+ANTEPRIME_DIR  = ARCHIVIO_DIR / 'public' / 'anteprime'
+STATE_PATH     = ARCHIVIO_DIR / '.cache' / 'anteprime.json'
+
+# Da incrementare quando cambia il disegno: invalida tutte le miniature
+ANTEPRIME_VERSION = 1
+
+# Geometria della miniatura (unità del viewBox)
+LARGHEZZA   = 160
+ALTEZZA     = 56
+MARGINE     = 4
+LATO_MAPPA  = ALTEZZA                 # riquadro quadrato del tracciato, a sinistra
+TOLLERANZA  = 0.6                     # Douglas-Peucker, in unità del viewBox
+PUNTI_PROFILO = 40                    # punti LTTB del profilo
+
+COLORE_TRACCIATO = '#d4401a'          # --accent del sito
+COLORE_PROFILO   = '#8a847e'
+RIEMPIMENTO_PROFILO = '#ede9e2'       # --bg3 del sito
+
+
+# ── GEOMETRIA ─────────────────────────────────────────────────────────────────
+
+def project_route(track: RouteTrack) -> list[tuple[float, float]]:
+    """
+    Lat/lon → punti nel riquadro del tracciato, proporzioni conservate
+    (equirettangolare con scala cos(lat) sulla longitudine, y verso il basso).
+    """
+    lat0 = math.radians((min(track.lat) + max(track.lat)) / 2)
+    k = math.cos(lat0)
+    xs = [lon * k for lon in track.lon]
+    ys = [-lat for lat in track.lat]
+    x0, y0 = min(xs), min(ys)
+    span = max(max(xs) - x0, max(ys) - y0) or 1.0
+    size = LATO_MAPPA - 2 * MARGINE
+    # Centra il lato corto
+    dx = (size - (max(xs) - x0) / span * size) / 2
+    dy = (size - (max(ys) - y0) / span * size) / 2
+    return [(MARGINE + dx + (x - x0) / span * size, MARGINE + dy + (y - y0) / span * size)
+            for x, y in zip(xs, ys)]
+
+
+def simplify(points: list[tuple[float, float]], tolerance: float) -> list[tuple[float, float]]:
+    """Douglas-Peucker iterativo: tiene i punti che si scostano più di `tolerance`."""
+    n = len(points)
+    if n < 3:
+        return list(points)
+    keep = bytearray(n)
+    keep[0] = keep[-1] = 1
+    stack = [(0, n - 1)]
+    tol2 = tolerance * tolerance
+    while stack:
+        a, b = stack.pop()
+        ax, ay = points[a]
+        bx, by = points[b]
+        vx, vy = bx - ax, by - ay
+        len2 = vx * vx + vy * vy
+        best, best_d = -1, tol2
+        for i in range(a + 1, b):
+            px, py = points[i]
+            wx, wy = px - ax, py - ay
+            if len2 == 0:
+                d = wx * wx + wy * wy
+            else:
+                t = max(0.0, min(1.0, (wx * vx + wy * vy) / len2))
+                ex, ey = wx - t * vx, wy - t * vy
+                d = ex * ex + ey * ey
+            if d > best_d:
+                best, best_d = i, d
+        if best >= 0:
+            keep[best] = 1
+            stack.append((a, best))
+            stack.append((best, b))
+    return [p for p, k in zip(points, keep) if k]
+
+
+def num(v: float) -> str:
+    """Coordinata a un decimale, senza zeri inutili (12.0 → 12)."""
+    s = f"{v:.1f}"
+    return s[:-2] if s.endswith('.0') else s
+
+
+def path_data(points: list[tuple[float, float]]) -> str:
+    """Attributo d di un <path>: coordinate a un decimale, punti ripetuti saltati."""
+    out = []
+    prev = None
+    for x, y in points:
+        cur = (num(x), num(y))
+        if cur != prev:
+            out.append(('M' if prev is None else 'L') + cur[0] + ' ' + cur[1])
+            prev = cur
+    return ''.join(out)
+
+
+def profile_points(track: RouteTrack) -> list[tuple[float, float]] | None:
+    """Profilo LTTB nel riquadro di destra, o None se la traccia non ha quote."""
+    if not track.valid_ele:
+        return None
+    dist = track.cum_dist
+    total = dist[-1] or 1.0
+    idx = track.lttb(PUNTI_PROFILO)
+    eles = [track.ele[i] for i in idx]
+    known = [e for e in eles if not math.isnan(e)]
+    if not known:
+        return None
+    lo, hi = min(known), max(known)
+    span = (hi - lo) or 1.0
+    x0 = LATO_MAPPA + MARGINE
+    width = LARGHEZZA - MARGINE - x0
+    height = ALTEZZA - 2 * MARGINE
+    pts = []
+    for i, e in zip(idx, eles):
+        e = lo if math.isnan(e) else e
+        pts.append((x0 + dist[i] / total * width, MARGINE + height - (e - lo) / span * height))
+    return pts
+
+
+# ── SVG ───────────────────────────────────────────────────────────────────────
+
+def render_thumbnail(track: RouteTrack) -> str:
+    """SVG della miniatura (stringa vuota se la traccia ha meno di 2 punti)."""
+    if len(track) < 2:
+        return ''
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {LARGHEZZA} {ALTEZZA}" '
+             f'width="{LARGHEZZA}" height="{ALTEZZA}" fill="none" stroke-linejoin="round" '
+             f'stroke-linecap="round">']
+    profile = profile_points(track)
+    if profile:
+        line = path_data(profile)
+        base_y = num(ALTEZZA - MARGINE)
+        area = f"{line}L{num(profile[-1][0])} {base_y}L{num(profile[0][0])} {base_y}Z"
+        parts.append(f'<path d="{area}" fill="{RIEMPIMENTO_PROFILO}"/>')
+        parts.append(f'<path d="{line}" stroke="{COLORE_PROFILO}" stroke-width="1.2"/>')
+    route = simplify(project_route(track), TOLLERANZA)
+    parts.append(f'<path d="{path_data(route)}" stroke="{COLORE_TRACCIATO}" stroke-width="1.6"/>')
+    parts.append('</svg>')
+    return ''.join(parts)
+
+
+# ── STATO ─────────────────────────────────────────────────────────────────────
+
+def load_state() -> dict:
+    """Hash dei GPX già disegnati, o uno stato vuoto se mancante/incompatibile."""
+    empty = {'versione': ANTEPRIME_VERSION, 'tracce': {}}
+    try:
+        state = json.loads(STATE_PATH.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return empty
+    if state.get('versione') != ANTEPRIME_VERSION:
+        return empty
+    return state
+
+
+# ── MAIN ──────────────────────────────────────────────────────────────────────
+
+def build_thumbnails(full: bool = False) -> int:
+    """Aggiorna le miniature. Ritorna il numero di file riscritti o rimossi."""
+    state = {'versione': ANTEPRIME_VERSION, 'tracce': {}} if full else load_state()
+    old = state['tracce']
+    new = {}
+    changed = 0
+
+    gpx_files = {p.stem: p for p in sorted(GPX_DIR.glob('*.gpx'))} if GPX_DIR.exists() else {}
+    for slug, path in gpx_files.items():
+        digest = hashlib.sha256(path.read_bytes()).hexdigest()
+        out = ANTEPRIME_DIR / f"{slug}.svg"
+        if old.get(slug) == digest and out.exists():
+            new[slug] = digest
+            continue
+        svg = render_thumbnail(cached_track(path, digest))
+        if not svg:
+            print(f"  [SKIP] {slug}: traccia senza punti")
+            out.unlink(missing_ok=True)
+            continue
+        write_text_atomic(out, svg)
+        new[slug] = digest
+        changed += 1
+        print(f"  [*] {slug}: {len(svg)} byte")
+
+    for old_svg in ANTEPRIME_DIR.glob('*.svg') if ANTEPRIME_DIR.exists() else ():
+        if old_svg.stem not in new:
+            old_svg.unlink()
+            changed += 1
+            print(f"  [-] {old_svg.stem}: rimosso")
+
+    indice = {slug: digest[:10] for slug, digest in sorted(new.items())}
+    write_text_atomic(ANTEPRIME_DIR / 'indice.json', json.dumps(indice, indent=2), skip_unchanged=True)
+    state['tracce'] = new
+    write_text_atomic(STATE_PATH, json.dumps(state, sort_keys=True))
+    return changed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Genera le miniature SVG delle gare per la pagina indice')
+    parser.add_argument('--completo', action='store_true', help='ignora la cache e ridisegna tutto')
+    args = parser.parse_args()
+
+    print(f"[*] Miniature da {GPX_DIR}...")
+    n = build_thumbnails(full=args.completo)
+    print(f"[OK] {n} miniature aggiornate -> {ANTEPRIME_DIR}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+genera_catalogo.py — Catalogo a pagine delle gare per la pagina indice.
+
+Uso:
+    python generator/genera_catalogo.py                 # pagine da 48 gare
+    python generator/genera_catalogo.py --dimensione 24
+
+Legge tutti i gare-sorgenti/*.json, li ordina per data (più recenti prima) e
+scrive in public/catalogo/ (va lanciato dopo genera_anteprime.py, di cui
+riporta nei record la versione delle miniature):
+  pagina-000.json, pagina-001.json, ...   le gare, a blocchi di dimensione fissa
+  manifest.json                           totali, aggregati per i filtri e,
+                                          per ogni pagina, anni e intervallo di date
+  ricerca.json                            indice a trigrammi su titolo, luogo e note
+
+La pagina indice incorpora solo la prima pagina e scarica le altre quando
+l'utente scorre o quando un filtro ne ha bisogno (il filtro per anno scarica
+solo le pagine che contengono quell'anno, grazie al manifest).
+
+L'indice di ricerca usa la stessa normalizzazione di slugify (fold_text):
+ogni parola diventa "  parola " e se ne prendono i trigrammi, come pg_trgm.
+Per ogni trigramma c'è la lista delle gare che lo contengono, come posizioni
+nel catalogo codificate a differenze (la pagina di una gara è posizione //
+dimensione). Il client conta i trigrammi in comune con la query: la ricerca
+tollera errori di battitura e scarica solo le pagine con risultati.
+"""
+
+import sys
+import json
+import argparse
+from pathlib import Path
+
+from archivio_io import write_text_atomic
+from genera_report import fold_text
+
+ARCHIVIO_DIR = Path(__file__).parent.parent
+JSON_DIR     = ARCHIVIO_DIR / 'gare-sorgenti'
+CATALOGO_DIR = ARCHIVIO_DIR / 'public' / 'catalogo'
+ANTEPRIME_INDICE = ARCHIVIO_DIR / 'public' / 'anteprime' / 'indice.json'
+
+DIMENSIONE_PAGINA = 48     # gare per pagina (multiplo delle colonne della griglia)
+CATALOGO_VERSION = 1
+RICERCA_VERSION  = 1
+
+# Campi delle gare usati da card e filtri; il resto del JSON resta fuori
+CAMPI = ('slug', 'titolo', 'data', 'genere', 'categoria', 'disciplina',
+         'distanza_km', 'dislivello_m', 'luogo')
+
+# Campi indicizzati per la ricerca testuale
+CAMPI_RICERCA = ('titolo', 'luogo', 'note')
+
+
+def load_gare() -> list[dict]:
+    """JSON delle gare, ordinati per data decrescente (a parità, per slug)."""
+    gare = []
+    for p in sorted(JSON_DIR.glob('*.json')):
+        try:
+            gara = json.loads(p.read_text(encoding='utf-8'))
+        except ValueError:
+            print(f"  [SKIP] {p.name}: JSON non valido")
+            continue
+        if not gara.get('slug'):
+            gara['slug'] = p.stem
+        gare.append(gara)
+    gare.sort(key=lambda g: g['slug'])
+    gare.sort(key=lambda g: str(g.get('data') or ''), reverse=True)
+    return gare
+
+
+def load_thumbnails() -> dict[str, str]:
+    """slug → versione della miniatura (genera_anteprime.py), vuoto se non generate."""
+    try:
+        return json.loads(ANTEPRIME_INDICE.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+
+
+def catalog_record(gara: dict, anteprime: dict[str, str]) -> dict:
+    """La gara ridotta ai CAMPI non vuoti, più la versione della miniatura se c'è."""
+    record = {k: gara[k] for k in CAMPI if gara.get(k) not in (None, '')}
+    if gara['slug'] in anteprime:
+        record['anteprima'] = anteprime[gara['slug']]
+    return record
+
+
+# ── RICERCA ───────────────────────────────────────────────────────────────────
+
+def trigrams(text: str) -> set[str]:
+    """Trigrammi delle parole di `text` normalizzato, con padding "  parola "."""
+    out = set()
+    for word in fold_text(text).split():
+        padded = f"  {word} "
+        for i in range(len(padded) - 2):
+            out.add(padded[i:i + 3])
+    return out
+
+
+def build_search_index(gare: list[dict], size: int) -> dict:
+    """Indice invertito trigramma → posizioni nel catalogo (a differenze)."""
+    postings: dict[str, list[int]] = {}
+    for pos, gara in enumerate(gare):
+        text = ' '.join(str(gara.get(k) or '') for k in CAMPI_RICERCA)
+        for tri in trigrams(text):
+            postings.setdefault(tri, []).append(pos)
+    encoded = {}
+    for tri, ids in sorted(postings.items()):
+        prev = 0
+        deltas = []
+        for i in ids:
+            deltas.append(i - prev)
+            prev = i
+        encoded[tri] = deltas
+    return {'versione': RICERCA_VERSION, 'n': len(gare), 'dimensione': size, 'trigrammi': encoded}
+
+
+def year_of(gara: dict) -> str:
+    return str(gara.get('data', ''))[:4]
+
+
+def count_by(gare: list[dict], key) -> dict:
+    out = {}
+    for g in gare:
+        v = key(g)
+        if v:
+            out[v] = out.get(v, 0) + 1
+    return dict(sorted(out.items()))
+
+
+def build_catalog(size: int = DIMENSIONE_PAGINA) -> dict:
+    """Scrive pagine, indice di ricerca e manifest; ritorna il manifest."""
+    gare = load_gare()
+    anteprime = load_thumbnails()
+    pagine = []
+    for n, start in enumerate(range(0, len(gare), size)):
+        chunk = [catalog_record(g, anteprime) for g in gare[start:start + size]]
+        name = f"pagina-{n:03d}.json"
+        write_text_atomic(CATALOGO_DIR / name,
+                          json.dumps(chunk, ensure_ascii=False, separators=(',', ':'), sort_keys=True),
+                          skip_unchanged=True)
+        pagine.append({
+            'file': name,
+            'n':    len(chunk),
+            'anni': sorted({year_of(g) for g in chunk if year_of(g)}, reverse=True),
+            'da':   chunk[-1].get('data'),
+            'a':    chunk[0].get('data'),
+        })
+
+    # Pagine di un giro precedente con più gare
+    keep = {p['file'] for p in pagine}
+    for old in CATALOGO_DIR.glob('pagina-*.json'):
+        if old.name not in keep:
+            old.unlink()
+
+    manifest = {
+        'versione':   CATALOGO_VERSION,
+        'totale':     len(gare),
+        'dimensione': size,
+        'totale_km':  round(sum(float(g.get('distanza_km') or 0) for g in gare), 2),
+        'anni':       count_by(gare, year_of),
+        'generi':     count_by(gare, lambda g: g.get('genere')),
+        'categorie':  count_by(gare, lambda g: g.get('categoria')),
+        'discipline': count_by(gare, lambda g: g.get('disciplina')),
+        'pagine':     pagine,
+    }
+    write_text_atomic(CATALOGO_DIR / 'ricerca.json',
+                      json.dumps(build_search_index(gare, size), ensure_ascii=False, separators=(',', ':')),
+                      skip_unchanged=True)
+    write_text_atomic(CATALOGO_DIR / 'manifest.json',
+                      json.dumps(manifest, ensure_ascii=False, indent=2, sort_keys=True),
+                      skip_unchanged=True)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Genera il catalogo a pagine della pagina indice')
+    parser.add_argument('--dimensione', type=int, default=DIMENSIONE_PAGINA, help='gare per pagina')
+    args = parser.parse_args()
+
+    if not JSON_DIR.exists():
+        print(f"[FAIL] Cartella gare-sorgenti non trovata: {JSON_DIR}")
+        return 1
+    if args.dimensione < 1:
+        print(f"[FAIL] Dimensione pagina non valida: {args.dimensione}")
+        return 1
+
+    manifest = build_catalog(args.dimensione)
+    print(f"[OK] {manifest['totale']} gare in {len(manifest['pagine'])} pagine -> {CATALOGO_DIR}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+genera_heatmap.py — Piramide di tile XYZ (PNG) con la heatmap di tutti i percorsi.
+
+Rasterizza ogni public/gpx/*.gpx sulle tile web-mercator dei livelli di zoom
+configurati e scrive public/tiles/heatmap/{z}/{x}/{y}.png, più un meta.json
+con bounds e livelli, letto dalla pagina indice.
+
+Uso:
+    python generator/genera_heatmap.py              # aggiorna solo le tile toccate
+    python generator/genera_heatmap.py --completo   # rigenera tutto
+
+Incrementale: lo stato (hash di ogni GPX + tile che tocca) è salvato in
+.cache/heatmap.json. Al giro successivo vengono ridisegnate solo le tile
+toccate da percorsi nuovi, modificati o rimossi.
+"""
+
+import sys
+import json
+import math
+import shutil
+import struct
+import hashlib
+import zlib
+import argparse
+from pathlib import Path
+
+from traccia import RouteTrack
+from cache_tracce import cached_track
+from archivio_io import write_bytes_atomic, write_text_atomic
+
+ARCHIVIO_DIR = Path(__file__).parent.parent
+GPX_DIR      = ARCHIVIO_DIR / 'public' / 'gpx'
+TILES_DIR    = ARCHIVIO_DIR / 'public' / 'tiles' / 'heatmap'
+STATE_PATH   = ARCHIVIO_DIR / '.cache' / 'heatmap.json'
+
+TILE_SIZE = 256
+ZOOM_MIN  = 5
+ZOOM_MAX  = 12
+STATE_VERSION = 2
+
+# Scala colori fissa (non dipende dal numero di percorsi, così una tile
+# cambia solo se cambiano i percorsi che la attraversano)
+HEAT_SATURAZIONE = 16                 # passaggi oltre i quali il colore non cresce
+HEAT_DA = (252, 82, 0, 150)           # 1 percorso: arancio del report
+HEAT_A  = (255, 214, 10, 255)         # ≥ HEAT_SATURAZIONE percorsi: giallo pieno
+
+
+# ── PROIEZIONE ────────────────────────────────────────────────────────────────
+
+def project(lat: float, lon: float, zoom: int) -> tuple[float, float]:
+    """Coordinate pixel globali web-mercator al livello di zoom dato."""
+    scale = TILE_SIZE * (1 << zoom)
+    lat = max(-85.05112878, min(85.05112878, lat))
+    s = math.sin(math.radians(lat))
+    x = (lon + 180.0) / 360.0 * scale
+    y = (0.5 - math.log((1 + s) / (1 - s)) / (4 * math.pi)) * scale
+    return x, y
+
+
+def rasterize(track: RouteTrack, zoom: int) -> dict[tuple[int, int], set[int]]:
+    """
+    Pixel accesi dal percorso, raggruppati per tile: {(x, y): {py*256+px, ...}}.
+    Linea di 2 px tra punti consecutivi (Bresenham).
+    """
+    tiles: dict[tuple[int, int], set[int]] = {}
+    limit = TILE_SIZE * (1 << zoom) - 1
+
+    def stamp(gx, gy):
+        for sx, sy in ((gx, gy), (gx + 1, gy), (gx, gy + 1), (gx + 1, gy + 1)):
+            if 0 <= sx <= limit and 0 <= sy <= limit:
+                key = (sx // TILE_SIZE, sy // TILE_SIZE)
+                pix = tiles.get(key)
+                if pix is None:
+                    pix = tiles[key] = set()
+                pix.add((sy % TILE_SIZE) * TILE_SIZE + sx % TILE_SIZE)
+
+    prev = None
+    for lat, lon in zip(track.lat, track.lon):
+        x, y = project(lat, lon, zoom)
+        cur = (int(x), int(y))
+        if prev is None:
+            stamp(*cur)
+        elif cur != prev:
+            x0, y0 = prev
+            x1, y1 = cur
+            dx, dy = abs(x1 - x0), -abs(y1 - y0)
+            sx = 1 if x0 < x1 else -1
+            sy = 1 if y0 < y1 else -1
+            err = dx + dy
+            while True:
+                stamp(x0, y0)
+                if x0 == x1 and y0 == y1:
+                    break
+                e2 = 2 * err
+                if e2 >= dy:
+                    err += dy; x0 += sx
+                if e2 <= dx:
+                    err += dx; y0 += sy
+        prev = cur
+    return tiles
+
+
+# ── PNG ───────────────────────────────────────────────────────────────────────
+
+def heat_color(count: int) -> tuple[int, int, int, int]:
+    t = min(1.0, math.log(count) / math.log(HEAT_SATURAZIONE))
+    return tuple(round(a + (b - a) * t) for a, b in zip(HEAT_DA, HEAT_A))
+
+
+def encode_png(counts: dict[int, int]) -> bytes:
+    """PNG RGBA 256×256 (trasparente dove non passa nessun percorso)."""
+    row_len = TILE_SIZE * 4
+    raw = bytearray((row_len + 1) * TILE_SIZE)   # filtro 0 su ogni riga
+    palette = {}
+    for pix, count in counts.items():
+        color = palette.get(count)
+        if color is None:
+            color = palette[count] = bytes(heat_color(count))
+        py, px = divmod(pix, TILE_SIZE)
+        off = py * (row_len + 1) + 1 + px * 4
+        raw[off:off + 4] = color
+
+    def chunk(tag, data):
+        body = tag + data
+        return struct.pack('>I', len(data)) + body + struct.pack('>I', zlib.crc32(body))
+
+    ihdr = struct.pack('>IIBBBBB', TILE_SIZE, TILE_SIZE, 8, 6, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', ihdr)
+            + chunk(b'IDAT', zlib.compress(bytes(raw), 9)) + chunk(b'IEND', b''))
+
+
+# ── STATO ─────────────────────────────────────────────────────────────────────
+
+def load_state(zoom_min: int, zoom_max: int) -> dict:
+    """Stato del giro precedente, o uno vuoto se mancante/incompatibile."""
+    empty = {'versione': STATE_VERSION, 'zoom': [zoom_min, zoom_max], 'tracce': {}}
+    try:
+        state = json.loads(STATE_PATH.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return empty
+    if state.get('versione') != STATE_VERSION or state.get('zoom') != [zoom_min, zoom_max]:
+        return empty
+    if not TILES_DIR.exists():
+        return empty
+    return state
+
+
+def save_state(state: dict):
+    write_text_atomic(STATE_PATH, json.dumps(state, sort_keys=True))
+
+
+def tile_key(z: int, x: int, y: int) -> str:
+    return f"{z}/{x}/{y}"
+
+
+# ── MAIN ──────────────────────────────────────────────────────────────────────
+
+def build_heatmap(zoom_min: int = ZOOM_MIN, zoom_max: int = ZOOM_MAX, full: bool = False) -> int:
+    """Aggiorna la piramide. Ritorna il numero di tile riscritte o rimosse."""
+    state = {'versione': STATE_VERSION, 'zoom': [zoom_min, zoom_max], 'tracce': {}} \
+        if full else load_state(zoom_min, zoom_max)
+    if not state['tracce'] and TILES_DIR.exists():
+        shutil.rmtree(TILES_DIR)     # ricostruzione completa: niente tile orfane
+
+    gpx_files = {p.stem: p for p in sorted(GPX_DIR.glob('*.gpx'))} if GPX_DIR.exists() else {}
+    old = state['tracce']
+    new = {}
+    tracks = {}
+    dirty = set()
+    # Pixel per (percorso, zoom): calcolati una volta, servono sia per sapere
+    # quali tile tocca un percorso nuovo sia per ridisegnarle
+    raster: dict[tuple[str, int], dict] = {}
+
+    for slug, path in gpx_files.items():
+        digest = hashlib.sha256(path.read_bytes()).hexdigest()
+        prev = old.get(slug)
+        if prev and prev['hash'] == digest:
+            new[slug] = prev
+            continue
+        track = tracks[slug] = cached_track(path, digest)
+        for z in range(zoom_min, zoom_max + 1):
+            raster[(slug, z)] = rasterize(track, z)
+        touched = sorted(
+            tile_key(z, x, y)
+            for z in range(zoom_min, zoom_max + 1)
+            for (x, y) in raster[(slug, z)]
+        )
+        new[slug] = {
+            'hash':   digest,
+            'tiles':  touched,
+            # None per un GPX senza punti: non deve spostare i bounds della mappa
+            'bounds': [min(track.lat), min(track.lon), max(track.lat), max(track.lon)] if len(track) else None,
+        }
+        dirty.update(touched)
+        if prev:
+            dirty.update(prev['tiles'])
+        print(f"  [*] {slug}: {len(touched)} tile")
+
+    for slug in old.keys() - new.keys():
+        dirty.update(old[slug]['tiles'])
+        print(f"  [-] {slug}: rimosso")
+
+    # Percorsi che attraversano ogni tile da ridisegnare
+    by_tile: dict[str, list[str]] = {}
+    for slug, info in new.items():
+        for key in info['tiles']:
+            if key in dirty:
+                by_tile.setdefault(key, []).append(slug)
+
+    # Ridisegna le tile sporche (i percorsi non cambiati si rasterizzano solo qui)
+    for key in sorted(dirty):
+        z, x, y = (int(v) for v in key.split('/'))
+        out = TILES_DIR / str(z) / str(x) / f"{y}.png"
+        slugs = by_tile.get(key)
+        if not slugs:
+            out.unlink(missing_ok=True)
+            continue
+        counts: dict[int, int] = {}
+        for slug in slugs:
+            if (slug, z) not in raster:
+                if slug not in tracks:
+                    tracks[slug] = cached_track(gpx_files[slug], new[slug]['hash'])
+                raster[(slug, z)] = rasterize(tracks[slug], z)
+            for pix in raster[(slug, z)].get((x, y), ()):
+                counts[pix] = counts.get(pix, 0) + 1
+        write_bytes_atomic(out, encode_png(counts), skip_unchanged=True)
+
+    # Meta per la pagina indice
+    bounds = [b['bounds'] for b in new.values() if b['bounds']]
+    if bounds:
+        meta = {
+            'zoom_min': zoom_min,
+            'zoom_max': zoom_max,
+            'percorsi': len(bounds),
+            'bounds': [
+                [min(b[0] for b in bounds), min(b[1] for b in bounds)],
+                [max(b[2] for b in bounds), max(b[3] for b in bounds)],
+            ],
+        }
+        write_text_atomic(TILES_DIR / 'meta.json', json.dumps(meta, sort_keys=True, indent=2), skip_unchanged=True)
+    elif (TILES_DIR / 'meta.json').exists():
+        (TILES_DIR / 'meta.json').unlink()
+
+    state['tracce'] = new
+    save_state(state)
+    return len(dirty)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Genera la heatmap a tile di tutti i percorsi')
+    parser.add_argument('--zoom-min', type=int, default=ZOOM_MIN)
+    parser.add_argument('--zoom-max', type=int, default=ZOOM_MAX)
+    parser.add_argument('--completo', action='store_true', help='ignora lo stato e rigenera tutte le tile')
+    args = parser.parse_args()
+
+    if not 0 <= args.zoom_min <= args.zoom_max <= 18:
+        print(f"[FAIL] Intervallo di zoom non valido: {args.zoom_min}-{args.zoom_max}")
+        return 1
+
+    print(f"[*] Heatmap z{args.zoom_min}-{args.zoom_max} da {GPX_DIR}...")
+    n = build_heatmap(args.zoom_min, args.zoom_max, full=args.completo)
+    print(f"[OK] {n} tile aggiornate -> {TILES_DIR}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+genera_manifest.py — Impronte (hash del contenuto) dei file pubblicati in public/.
+
+Uso:
+    python generator/genera_manifest.py              # aggiorna public/impronte.json
+    python generator/genera_manifest.py --completo   # rilegge e ricalcola tutto
+
+Va lanciato dopo gli altri generatori, come ultimo passo prima di astro build.
+Scrive public/impronte.json:
+    {"algoritmo": "sha256", "versione": 1, "file": {
+      "gare/cittiglio.html": {"byte": 412345, "hash": "3f2a9c0d5e7b1a44"},
+      ...}}
+
+`hash` sono le prime 16 cifre dello sha256 del file: fa da ETag forte per
+validare le cache e da revisione per il precache del service worker. I
+generatori scrivono gli stessi byte per gli stessi input, quindi una gara non
+modificata tiene lo stesso hash da un deploy all'altro, e le sue voci in cache.
+
+Incrementale: .cache/impronte.json ricorda dimensione, data di modifica e hash
+di ogni file; se dimensione e data non cambiano il file non viene riletto (le
+scritture di archivio_io con skip_unchanged lasciano intatti i file identici).
+"""
+
+import sys
+import json
+import argparse
+from pathlib import Path
+
+from cache_tracce import file_digest
+from archivio_io import write_text_atomic
+
+ARCHIVIO_DIR  = Path(__file__).parent.parent
+PUBLIC_DIR    = ARCHIVIO_DIR / 'public'
+MANIFEST_PATH = PUBLIC_DIR / 'impronte.json'
+STATE_PATH    = ARCHIVIO_DIR / '.cache' / 'impronte.json'
+
+MANIFEST_VERSION = 1
+CIFRE_HASH = 16            # cifre esadecimali dello sha256 tenute nel manifest
+
+
+def published_files() -> list[Path]:
+    """File di public/ in ordine di percorso, esclusi nascosti/temporanei e il manifest."""
+    out = []
+    for p in PUBLIC_DIR.rglob('*') if PUBLIC_DIR.exists() else ():
+        rel = p.relative_to(PUBLIC_DIR)
+        if p == MANIFEST_PATH or any(part.startswith('.') for part in rel.parts):
+            continue
+        if p.is_file():
+            out.append(p)
+    return sorted(out, key=lambda p: p.relative_to(PUBLIC_DIR).as_posix())
+
+
+def load_state() -> dict:
+    """percorso → [byte, mtime_ns, sha256] del giro precedente (vuoto se mancante)."""
+    try:
+        state = json.loads(STATE_PATH.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+    if state.get('versione') != MANIFEST_VERSION:
+        return {}
+    return state.get('file', {})
+
+
+def load_manifest() -> dict:
+    """Voci del manifest pubblicato in precedenza (vuoto se mancante)."""
+    try:
+        return json.loads(MANIFEST_PATH.read_text(encoding='utf-8')).get('file', {})
+    except (OSError, ValueError):
+        return {}
+
+
+def manifest_text(entries: dict) -> str:
+    """JSON del manifest, una riga per file: diff leggibili e byte stabili."""
+    lines = [f"    {json.dumps(rel)}: {json.dumps(entries[rel], sort_keys=True)}"
+             for rel in sorted(entries)]
+    head = f'{{"algoritmo": "sha256", "versione": {MANIFEST_VERSION}, "file": {{'
+    return head + ('\n' + ',\n'.join(lines) + '\n' if lines else '') + '}}\n'
+
+
+def build_manifest(full: bool = False) -> tuple[dict, dict]:
+    """Aggiorna manifest e stato; ritorna (voci, conteggi di nuovi/cambiati/rimossi)."""
+    old_state = {} if full else load_state()
+    old = load_manifest()
+    state, entries = {}, {}
+    hashed = 0
+    for p in published_files():
+        rel = p.relative_to(PUBLIC_DIR).as_posix()
+        st = p.stat()
+        prev = old_state.get(rel)
+        if prev and prev[0] == st.st_size and prev[1] == st.st_mtime_ns:
+            digest = prev[2]
+        else:
+            digest = file_digest(p)
+            hashed += 1
+        state[rel] = [st.st_size, st.st_mtime_ns, digest]
+        entries[rel] = {'byte': st.st_size, 'hash': digest[:CIFRE_HASH]}
+
+    write_text_atomic(MANIFEST_PATH, manifest_text(entries), skip_unchanged=True)
+    write_text_atomic(STATE_PATH, json.dumps({'versione': MANIFEST_VERSION, 'file': state},
+                                             sort_keys=True), skip_unchanged=True)
+    counts = {
+        'letti':    hashed,
+        'nuovi':    sum(1 for rel in entries if rel not in old),
+        'cambiati': sum(1 for rel in entries if rel in old and old[rel] != entries[rel]),
+        'rimossi':  sum(1 for rel in old if rel not in entries),
+    }
+    return entries, counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Genera il manifest degli hash dei file pubblicati')
+    parser.add_argument('--completo', action='store_true', help='ignora la cache e rilegge tutti i file')
+    args = parser.parse_args()
+
+    if not PUBLIC_DIR.exists():
+        print(f"[FAIL] Cartella public non trovata: {PUBLIC_DIR}")
+        return 1
+
+    entries, c = build_manifest(full=args.completo)
+    print(f"[*] {len(entries)} file, {c['letti']} riletti: "
+          f"{c['nuovi']} nuovi, {c['cambiati']} cambiati, {c['rimossi']} rimossi")
+    print(f"[OK] Manifest -> {MANIFEST_PATH}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -22,14 +22,17 @@ Lo script:
 import sys
 import re
 import json
-import math
 import base64
 import argparse
 import subprocess
-import xml.etree.ElementTree as ET
 from pathlib import Path
 from datetime import date
 
+from traccia import RouteAnalysis
+from cache_tracce import cached_analysis
+from build_all_reports import generate_full_report
+from archivio_io import SlugTakenError, copy_atomic, reserve_slug, write_text_atomic
+
 # ── CONFIGURAZIONE ───────────────────────────────────────────────────────────
 ARCHIVIO_DIR = Path(__file__).parent.parent
 # ─────────────────────────────────────────────────────────────────────────────
@@ -42,128 +45,81 @@ CATEGORIE  = ["Elite", "U23", "Junior", "Allievi"]
 GENERI     = ["Maschile", "Femminile"]
 DISCIPLINE = ["Strada", "Criterium", "Cronometro"]
 
+# Ordine dei campi nel JSON di una gara; eventuali altri campi seguono in ordine alfabetico
+CAMPI_GARA = ("slug", "titolo", "data", "genere", "categoria", "disciplina",
+              "distanza_km", "dislivello_m", "luogo", "note")
+
 
 # ── PARSING GPX ───────────────────────────────────────────────────────────────
 
 def parse_gpx(gpx_path: Path) -> dict:
-    """Estrae distanza (km) e dislivello positivo (m) dal file GPX."""
+    """
+    Estrae distanza (km) e dislivello positivo (m) dal file GPX.
+    Passa dalla cache delle tracce: un file già visto non viene riletto.
+    """
     try:
-        tree = ET.parse(gpx_path)
-        root = tree.getroot()
-        ns = ''
-        if root.tag.startswith('{'):
-            ns = root.tag.split('}')[0] + '}'
-
-        points = root.findall(f'.//{ns}trkpt')
-        if not points:
-            points = root.findall(f'.//{ns}rtept')
-
-        if not points:
-            return {'distanza_km': None, 'dislivello_m': None}
-
-        coords = []
-        for pt in points:
-            try:
-                lat = float(pt.get('lat'))
-                lon = float(pt.get('lon'))
-                ele_el = pt.find(f'{ns}ele')
-                ele = float(ele_el.text) if ele_el is not None else None
-                coords.append((lat, lon, ele))
-            except (TypeError, ValueError):
-                continue
-
-        if not coords:
-            return {'distanza_km': None, 'dislivello_m': None}
-
-        def haversine(lat1, lon1, lat2, lon2):
-            R = 6371000
-            φ1, φ2 = math.radians(lat1), math.radians(lat2)
-            dφ = math.radians(lat2 - lat1)
-            dλ = math.radians(lon2 - lon1)
-            a = math.sin(dφ/2)**2 + math.cos(φ1)*math.cos(φ2)*math.sin(dλ/2)**2
-            return R * 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-
-        dist_m = sum(
-            haversine(coords[i][0], coords[i][1], coords[i+1][0], coords[i+1][1])
-            for i in range(len(coords)-1)
-        )
-
-        # Smoothing quote con media mobile (finestra 5) per ridurre rumore GPS
-        eles_raw = [c[2] for c in coords if c[2] is not None]
-        w = 5
-        eles = []
-        for i in range(len(eles_raw)):
-            start = max(0, i - w // 2)
-            end   = min(len(eles_raw), i + w // 2 + 1)
-            eles.append(sum(eles_raw[start:end]) / (end - start))
-
-        d_plus = 0.0
-        for i in range(1, len(eles)):
-            diff = eles[i] - eles[i-1]
-            if diff > 0:
-                d_plus += diff
-
-        # Punto centrale per il geocoding
-        mid = coords[len(coords) // 2]
-        center_lat, center_lon = mid[0], mid[1]
-
-        return {
-            'distanza_km': round(dist_m / 1000, 2),
-            'dislivello_m': round(d_plus) if d_plus > 0 else None,
-            'center_lat':   center_lat,
-            'center_lon':   center_lon,
-        }
-
+        return cached_analysis(gpx_path).as_dict()
     except Exception as e:
         print(f"  Avviso: impossibile leggere dati dal GPX ({e})")
-        return {'distanza_km': None, 'dislivello_m': None, 'center_lat': None, 'center_lon': None}
+        return RouteAnalysis().as_dict()
 
 
 # ── REVERSE GEOCODING ─────────────────────────────────────────────────────────
 
-def reverse_geocode(lat: float, lon: float) -> str | None:
-    """
-    Ritorna 'Provincia, Regione, IT' tramite Nominatim (OpenStreetMap).
-    Nessuna API key richiesta. Ritorna None se offline o in caso di errore.
-    """
+NOMINATIM_URL = "https://nominatim.openstreetmap.org"
+NOMINATIM_USER_AGENT = "race-db-archivio/1.0"
+
+
+def nominatim_reverse(lat: float, lon: float, base_url: str = NOMINATIM_URL, timeout: float = 5) -> dict:
+    """Chiamata /reverse a Nominatim. Solleva eccezione se offline o in errore HTTP."""
     import urllib.request
     import urllib.parse
     import json as _json
 
-    try:
-        params = urllib.parse.urlencode({
-            "lat": round(lat, 5),
-            "lon": round(lon, 5),
-            "format": "json",
-            "zoom": 8,          # livello regione/provincia
-            "addressdetails": 1,
-        })
-        url = f"https://nominatim.openstreetmap.org/reverse?{params}"
-        req = urllib.request.Request(url, headers={"User-Agent": "race-db-archivio/1.0"})
-        with urllib.request.urlopen(req, timeout=5) as resp:
-            data = _json.loads(resp.read())
-
-        addr = data.get("address", {})
-
-        # Provincia (county o city)
-        provincia = (
-            addr.get("county") or
-            addr.get("city") or
-            addr.get("town") or
-            addr.get("village") or
-            ""
-        )
-        # Rimuovi suffissi tipo "Provincia di Varese" → "Varese"
-        for prefix in ("Provincia di ", "Province of ", "Distretto di "):
-            if provincia.startswith(prefix):
-                provincia = provincia[len(prefix):]
+    params = urllib.parse.urlencode({
+        "lat": round(lat, 5),
+        "lon": round(lon, 5),
+        "format": "json",
+        "zoom": 8,          # livello regione/provincia
+        "addressdetails": 1,
+    })
+    url = f"{base_url.rstrip('/')}/reverse?{params}"
+    req = urllib.request.Request(url, headers={"User-Agent": NOMINATIM_USER_AGENT})
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        return _json.loads(resp.read())
+
+
+def format_luogo(data: dict) -> str | None:
+    """Risposta Nominatim → 'Provincia, IT' (None se non c'è nulla di utile)."""
+    addr = data.get("address", {})
+
+    # Provincia (county o city)
+    provincia = (
+        addr.get("county") or
+        addr.get("city") or
+        addr.get("town") or
+        addr.get("village") or
+        ""
+    )
+    # Rimuovi suffissi tipo "Provincia di Varese" → "Varese"
+    for prefix in ("Provincia di ", "Province of ", "Distretto di "):
+        if provincia.startswith(prefix):
+            provincia = provincia[len(prefix):]
 
-        # Stato abbreviato
-        country_code = addr.get("country_code", "").upper()  # "IT", "FR", "BE"...
+    # Stato abbreviato
+    country_code = addr.get("country_code", "").upper()  # "IT", "FR", "BE"...
 
-        parts = [p for p in [provincia, country_code] if p]
-        return ", ".join(parts) if parts else None
+    parts = [p for p in [provincia, country_code] if p]
+    return ", ".join(parts) if parts else None
 
+
+def reverse_geocode(lat: float, lon: float, base_url: str = NOMINATIM_URL) -> str | None:
+    """
+    Ritorna 'Provincia, Regione, IT' tramite Nominatim (OpenStreetMap).
+    Nessuna API key richiesta. Ritorna None se offline o in caso di errore.
+    """
+    try:
+        return format_luogo(nominatim_reverse(lat, lon, base_url))
     except Exception:
         return None
 
@@ -171,13 +127,88 @@ def reverse_geocode(lat: float, lon: float) -> str | None:
 
 # ── SLUG ─────────────────────────────────────────────────────────────────────
 
-def slugify(s: str) -> str:
+def fold_text(s: str) -> str:
+    """
+    Testo senza accenti, minuscolo, con solo lettere/cifre separate da uno spazio:
+    "Côte d'Azur" → "cote d azur". Base di slugify e dell'indice di ricerca
+    (il client replica la stessa normalizzazione in JS).
+    """
     import unicodedata
     s = unicodedata.normalize('NFD', s)
     s = ''.join(c for c in s if unicodedata.category(c) != 'Mn')
     s = s.lower()
-    s = re.sub(r'[^a-z0-9]+', '-', s)
-    return s.strip('-')
+    s = re.sub(r'[^a-z0-9]+', ' ', s)
+    return s.strip()
+
+
+def slugify(s: str) -> str:
+    return fold_text(s).replace(' ', '-')
+
+
+# ── METADATI ─────────────────────────────────────────────────────────────────
+
+def num_or_none(s: str) -> float | None:
+    """Numero da un campo di testo (None se vuoto o non numerico)."""
+    try: return float(s.strip()) if s.strip() else None
+    except ValueError: return None
+
+
+def validate_meta(meta: dict) -> list[str]:
+    """Errori nei metadati di una gara (lista vuota se sono validi)."""
+    errors = []
+    if not meta.get("titolo"): errors.append("Nome gara obbligatorio")
+    if not meta.get("slug"):   errors.append("Slug obbligatorio")
+    if not meta.get("data"):   errors.append("Data obbligatoria")
+    if not re.match(r"^\d{4}-\d{2}-\d{2}$", meta.get("data") or ""):
+        errors.append("Data nel formato AAAA-MM-GG")
+    for key, values in (("genere", GENERI), ("categoria", CATEGORIE), ("disciplina", DISCIPLINE)):
+        if meta.get(key) not in values:
+            errors.append(f"{key.capitalize()} tra: {', '.join(values)}")
+    return errors
+
+
+# ── SALVATAGGIO ──────────────────────────────────────────────────────────────
+
+def gara_json(gara: dict) -> str:
+    """
+    Testo del JSON di una gara: campi None omessi, chiavi sempre nello stesso
+    ordine (CAMPI_GARA, poi le altre in ordine alfabetico). Stessi dati, stessi byte,
+    da qualunque strada arrivino (dialog, servizio di ingest, geocodifica).
+    """
+    keys = [k for k in CAMPI_GARA if k in gara] + sorted(k for k in gara if k not in CAMPI_GARA)
+    return json.dumps({k: gara[k] for k in keys if gara[k] is not None}, ensure_ascii=False, indent=2)
+
+
+def save_race(meta: dict, gpx_path: Path, overwrite: bool = False) -> dict:
+    """
+    Aggiunge la gara all'archivio: GPX in public/gpx/, JSON in gare-sorgenti/,
+    report in public/gare/. Tutto avviene sotto il lock dell'archivio: lo slug
+    resta riservato finché i tre file non sono al loro posto (ognuno atomico).
+    Solleva SlugTakenError se lo slug esiste già e `overwrite` è False.
+    Ritorna i percorsi scritti: {'gpx': ..., 'json': ..., 'html': ...}.
+    """
+    slug = meta["slug"]
+    out_gpx_dir  = ARCHIVIO_DIR / "public" / "gpx"
+    out_json_dir = ARCHIVIO_DIR / "gare-sorgenti"
+    out_gpx_dir.mkdir(parents=True, exist_ok=True)
+    out_json_dir.mkdir(parents=True, exist_ok=True)
+
+    with reserve_slug(slug, overwrite=overwrite, json_dir=out_json_dir) as json_path:
+        # Copia GPX in public/gpx/
+        gpx_out = out_gpx_dir / f"{slug}.gpx"
+        copy_atomic(gpx_path, gpx_out)
+        print(f"[OK] GPX   -> {gpx_out}")
+
+        # Salva JSON (rimuovi None)
+        write_text_atomic(json_path, gara_json(meta), skip_unchanged=True)
+        print(f"[OK] JSON  -> {json_path}")
+
+        # Genera report HTML in public/gare/ (GPX incorporato + indici precalcolati)
+        template_path = Path(__file__).parent / "index.html"
+        html_out = ARCHIVIO_DIR / "public" / "gare" / f"{slug}.html"
+        generate_full_report(gpx_out, meta["titolo"], template_path.read_text(encoding='utf-8'), html_out)
+        print(f"[OK] HTML  -> {html_out}")
+    return {'gpx': gpx_out, 'json': json_path, 'html': html_out}
 
 
 # ── CALENDARIO POPUP ─────────────────────────────────────────────────────────
@@ -489,21 +520,7 @@ def ask_metadata(default_title: str, gpx_path_initial: Path, gpx_data: dict, luo
     cancelled = tk.BooleanVar(value=False)
 
     def on_ok():
-        errors = []
-        if not e_titolo.get().strip(): errors.append("Nome gara obbligatorio")
-        if not e_slug.get().strip():   errors.append("Slug obbligatorio")
-        if not e_data.get().strip():   errors.append("Data obbligatoria")
-        if not re.match(r"^\d{4}-\d{2}-\d{2}$", e_data.get().strip()):
-            errors.append("Data nel formato AAAA-MM-GG")
-        if errors:
-            messagebox.showerror("Errore", "\n".join(errors), parent=root)
-            return
-
-        def num_or_none(s):
-            try: return float(s.strip()) if s.strip() else None
-            except: return None
-
-        result.update({
+        meta = {
             "slug":         slugify(e_slug.get().strip()),
             "titolo":       e_titolo.get().strip(),
             "data":         e_data.get().strip(),
@@ -514,7 +531,12 @@ def ask_metadata(default_title: str, gpx_path_initial: Path, gpx_data: dict, luo
             "dislivello_m": num_or_none(e_dp.get()),
             "luogo":        e_luogo.get().strip() or None,
             "note":         e_note.get("1.0", tk.END).strip() or None,
-        })
+        }
+        errors = validate_meta(meta)
+        if errors:
+            messagebox.showerror("Errore", "\n".join(errors), parent=root)
+            return
+        result.update(meta)
         root.destroy()
 
     def on_cancel():
@@ -604,16 +626,9 @@ def main():
     slug  = meta["slug"]
     title = meta["titolo"]
 
-    # 4. Cartelle destinazione
-    out_gpx_dir  = ARCHIVIO_DIR / "public" / "gpx"
-    out_json_dir = ARCHIVIO_DIR / "gare-sorgenti"
-    out_gpx_dir.mkdir(parents=True, exist_ok=True)
-    out_json_dir.mkdir(parents=True, exist_ok=True)
-
-    json_path = out_json_dir / f"{slug}.json"
-
-
-    # 5. Avvisa se esiste già
+    # 4. Avvisa se esiste già
+    json_path = ARCHIVIO_DIR / "gare-sorgenti" / f"{slug}.json"
+    overwrite = False
     if json_path.exists():
         import tkinter as tk
         from tkinter import messagebox
@@ -624,17 +639,13 @@ def main():
         if not ok:
             print("Operazione annullata.")
             sys.exit(0)
+        overwrite = True
 
-    # 6. Copia GPX in public/gpx/
-    import shutil
-    gpx_out = out_gpx_dir / f"{slug}.gpx"
-    shutil.copy2(gpx_path, gpx_out)
-    print(f"[OK] GPX   -> {gpx_out}")
-
-    # 7. Salva JSON (rimuovi None)
-    meta_clean = {k: v for k, v in meta.items() if v is not None}
-    json_path.write_text(json.dumps(meta_clean, ensure_ascii=False, indent=2), encoding='utf-8')
-    print(f"[OK] JSON  -> {json_path}")
+    # 5. GPX, JSON e report, con lo slug riservato sotto il lock dell'archivio
+    try:
+        save_race(meta, gpx_path, overwrite=overwrite)
+    except SlugTakenError as e:
+        sys.exit(f"Errore: {e} (aggiunta nel frattempo da un'altra importazione).")
 
     print(f"\n[OK] Gara '{title}' aggiunta al database.")
     print("  Per pubblicare sul sito:")
@@ -642,7 +653,7 @@ def main():
     print(f"    git commit -m \"Aggiungi gara: {title}\"")
     print(f"    git push")
 
-    # 8. Popup finale
+    # 6. Popup finale
     try:
         import tkinter as tk
         from tkinter import messagebox
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+genera_salite.py — Catalogo delle salite di tutto l'archivio, interrogabile.
+
+Uso:
+    python generator/genera_salite.py                     # aggiorna database ed export
+    python generator/genera_salite.py aggiorna --completo # ricalcola tutte le gare
+    python generator/genera_salite.py cerca --min-km 1 --min-pendenza 7 \\
+        --categoria Junior --genere Femminile --anno 2026 --ordina pendenza_media
+
+Le salite di ogni gara sono rilevate da RouteTrack.climbs(), lo stesso
+algoritmo del report, e salvate in un database SQLite (.cache/salite.sqlite)
+con indici su lunghezza, pendenze e difficoltà e sui campi della gara usati
+nei filtri. Ogni salita registra gara, km di inizio e fine, lunghezza,
+dislivello, pendenza media e massima, difficoltà e livello.
+
+Incrementale: per ogni gara è salvato l'hash del GPX (con ANALYSIS_VERSION e
+SALITE_VERSION); al giro successivo si ricalcolano solo i GPX cambiati, mentre
+i metadati della gara (titolo, data, categoria...) vengono sempre riletti.
+
+A ogni aggiornamento il catalogo è esportato anche per il sito in
+public/catalogo/salite.json, a colonne ({"campi": [...], "salite": [[...], ...]}),
+ordinato per difficoltà decrescente.
+
+Da Python:
+    from contextlib import closing
+    from genera_salite import open_db, query_climbs
+    with closing(open_db()) as db:
+        for s in query_climbs(db, min_km=1, min_pendenza=7, anno=2026):
+            print(s['titolo'], s['start_km'], s['pendenza_media'])
+"""
+
+import sys
+import json
+import sqlite3
+import argparse
+from contextlib import closing
+from pathlib import Path
+
+from traccia import ANALYSIS_VERSION
+from cache_tracce import cached_track, file_digest
+from archivio_io import archive_lock, write_text_atomic
+
+ARCHIVIO_DIR = Path(__file__).parent.parent
+JSON_DIR     = ARCHIVIO_DIR / 'gare-sorgenti'
+GPX_DIR      = ARCHIVIO_DIR / 'public' / 'gpx'
+DB_PATH      = ARCHIVIO_DIR / '.cache' / 'salite.sqlite'
+EXPORT_PATH  = ARCHIVIO_DIR / 'public' / 'catalogo' / 'salite.json'
+
+SALITE_VERSION = 1     # da incrementare quando cambia lo schema o cosa si salva
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS gare (
+    slug        TEXT PRIMARY KEY,
+    titolo      TEXT,
+    data        TEXT,
+    anno        INTEGER,
+    genere      TEXT,
+    categoria   TEXT,
+    disciplina  TEXT,
+    hash        TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS salite (
+    slug            TEXT NOT NULL REFERENCES gare(slug) ON DELETE CASCADE,
+    n               INTEGER NOT NULL,
+    start_km        REAL NOT NULL,
+    end_km          REAL NOT NULL,
+    lunghezza_km    REAL NOT NULL,
+    dislivello_m    REAL NOT NULL,
+    pendenza_media  REAL NOT NULL,
+    pendenza_max    REAL NOT NULL,
+    difficolta      REAL NOT NULL,
+    livello         TEXT NOT NULL,
+    PRIMARY KEY (slug, n)
+);
+CREATE INDEX IF NOT EXISTS salite_lunghezza  ON salite(lunghezza_km);
+CREATE INDEX IF NOT EXISTS salite_pendenza   ON salite(pendenza_media);
+CREATE INDEX IF NOT EXISTS salite_max        ON salite(pendenza_max);
+CREATE INDEX IF NOT EXISTS salite_difficolta ON salite(difficolta);
+CREATE INDEX IF NOT EXISTS gare_filtri       ON gare(anno, categoria, genere, disciplina);
+"""
+
+# Colonne ordinabili ed esportate (nell'ordine dell'export)
+CAMPI_SALITA = ('start_km', 'end_km', 'lunghezza_km', 'dislivello_m',
+                'pendenza_media', 'pendenza_max', 'difficolta', 'livello')
+ORDINAMENTI = ('difficolta', 'pendenza_media', 'pendenza_max', 'lunghezza_km', 'dislivello_m', 'data')
+
+
+# ── DATABASE ──────────────────────────────────────────────────────────────────
+
+def open_db(path: Path = DB_PATH) -> sqlite3.Connection:
+    """
+    Connessione al database delle salite, creato se manca. Un database di
+    un'altra versione viene svuotato (è derivato: si ricostruisce dai GPX).
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    db = sqlite3.connect(path)
+    db.row_factory = sqlite3.Row
+    db.execute('PRAGMA foreign_keys = ON')
+    db.execute('PRAGMA journal_mode = WAL')      # lettori concorrenti durante l'aggiornamento
+    version = SALITE_VERSION * 1000 + ANALYSIS_VERSION
+    if db.execute('PRAGMA user_version').fetchone()[0] != version:
+        db.executescript('DROP TABLE IF EXISTS salite; DROP TABLE IF EXISTS gare;'
+                         + SCHEMA + f'PRAGMA user_version = {version};')
+    return db
+
+
+def _year(data) -> int | None:
+    try:
+        return int(str(data)[:4])
+    except ValueError:
+        return None
+
+
+def update_db(db: sqlite3.Connection, full: bool = False, log=print) -> tuple[int, int]:
+    """
+    Allinea il database all'archivio. Ritorna (gare ricalcolate, salite totali).
+    Legge JSON e GPX sotto il lock dell'archivio, per vederli coerenti.
+    """
+    known = {r['slug']: r['hash'] for r in db.execute('SELECT slug, hash FROM gare')}
+    seen = set()
+    recomputed = 0
+    with archive_lock(), db:
+        for json_path in sorted(JSON_DIR.glob('*.json')):
+            try:
+                gara = json.loads(json_path.read_text(encoding='utf-8'))
+            except ValueError:
+                log(f"  [SKIP] {json_path.name}: JSON non valido")
+                continue
+            slug = json_path.stem
+            gpx_path = GPX_DIR / f"{slug}.gpx"
+            if not gpx_path.exists():
+                continue
+            seen.add(slug)
+            digest = file_digest(gpx_path)
+            db.execute('INSERT INTO gare (slug, titolo, data, anno, genere, categoria, disciplina, hash) '
+                       'VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+                       'ON CONFLICT(slug) DO UPDATE SET titolo=excluded.titolo, data=excluded.data, '
+                       'anno=excluded.anno, genere=excluded.genere, categoria=excluded.categoria, '
+                       'disciplina=excluded.disciplina, hash=excluded.hash',
+                       (slug, gara.get('titolo'), gara.get('data'), _year(gara.get('data')),
+                        gara.get('genere'), gara.get('categoria'), gara.get('disciplina'), digest))
+            if not full and known.get(slug) == digest:
+                continue
+
+            climbs = cached_track(gpx_path, digest).climbs()
+            db.execute('DELETE FROM salite WHERE slug = ?', (slug,))
+            db.executemany(
+                'INSERT INTO salite VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(slug, n, round(c.start_m / 1000, 2), round(c.end_m / 1000, 2),
+                  round(c.lunghezza_m / 1000, 2), round(c.dislivello_m),
+                  round(c.pendenza_media, 1), round(c.pendenza_max, 1),
+                  round(c.difficolta, 1), c.livello)
+                 for n, c in enumerate(climbs)])
+            recomputed += 1
+            log(f"  [*] {slug}: {len(climbs)} salite")
+
+        for slug in known.keys() - seen:
+            db.execute('DELETE FROM gare WHERE slug = ?', (slug,))
+            log(f"  [-] {slug}: rimossa")
+    total = db.execute('SELECT COUNT(*) FROM salite').fetchone()[0]
+    return recomputed, total
+
+
+# ── INTERROGAZIONI ────────────────────────────────────────────────────────────
+
+def query_climbs(db: sqlite3.Connection, min_km: float | None = None, min_pendenza: float | None = None,
+                 min_pendenza_max: float | None = None, min_difficolta: float | None = None,
+                 anno: int | None = None, genere: str | None = None, categoria: str | None = None,
+                 disciplina: str | None = None, slug: str | None = None,
+                 ordina: str = 'difficolta', crescente: bool = False,
+                 limite: int | None = None) -> list[sqlite3.Row]:
+    """Salite che soddisfano tutti i filtri dati, con i campi della gara."""
+    if ordina not in ORDINAMENTI:
+        raise ValueError(f"ordinamento non valido: {ordina} (ammessi: {', '.join(ORDINAMENTI)})")
+    where, params = [], []
+    for column, op, value in (
+        ('s.lunghezza_km', '>=', min_km),
+        ('s.pendenza_media', '>=', min_pendenza),
+        ('s.pendenza_max', '>=', min_pendenza_max),
+        ('s.difficolta', '>=', min_difficolta),
+        ('g.anno', '=', anno),
+        ('g.genere', '=', genere),
+        ('g.categoria', '=', categoria),
+        ('g.disciplina', '=', disciplina),
+        ('g.slug', '=', slug),
+    ):
+        if value is not None:
+            where.append(f"{column} {op} ?")
+            params.append(value)
+    order_col = 'g.data' if ordina == 'data' else f's.{ordina}'
+    sql = ('SELECT g.slug, g.titolo, g.data, g.genere, g.categoria, g.disciplina, s.n, '
+           + ', '.join(f's.{c}' for c in CAMPI_SALITA)
+           + ' FROM salite s JOIN gare g ON g.slug = s.slug'
+           + (' WHERE ' + ' AND '.join(where) if where else '')
+           + f" ORDER BY {order_col} {'ASC' if crescente else 'DESC'}, g.slug, s.n")
+    if limite:
+        sql += ' LIMIT ?'
+        params.append(limite)
+    return db.execute(sql, params).fetchall()
+
+
+# ── EXPORT ────────────────────────────────────────────────────────────────────
+
+def export_json(db: sqlite3.Connection, path: Path = EXPORT_PATH) -> int:
+    """Scrive l'export per il sito; ritorna il numero di salite."""
+    rows = query_climbs(db)
+    data = {
+        'versione': SALITE_VERSION,
+        'campi': ['slug', 'n', *CAMPI_SALITA],
+        'salite': [[r['slug'], r['n'], *(r[c] for c in CAMPI_SALITA)] for r in rows],
+    }
+    write_text_atomic(path, json.dumps(data, ensure_ascii=False, separators=(',', ':')), skip_unchanged=True)
+    return len(rows)
+
+
+# ── MAIN ──────────────────────────────────────────────────────────────────────
+
+def print_rows(rows: list[sqlite3.Row]):
+    if not rows:
+        print("  Nessuna salita trovata.")
+        return
+    title_w = min(40, max(len(r['titolo'] or r['slug']) for r in rows))
+    print(f"  {'gara':<{title_w}} {'data':<10} {'km':>11} {'lung.':>6} {'D+':>5} "
+          f"{'media':>6} {'max':>6} {'diff.':>6}  livello")
+    for r in rows:
+        title = (r['titolo'] or r['slug'])[:title_w]
+        km = f"{r['start_km']:.1f}-{r['end_km']:.1f}"
+        print(f"  {title:<{title_w}} {r['data'] or '':<10} {km:>11} {r['lunghezza_km']:>6.2f} "
+              f"{r['dislivello_m']:>5.0f} {r['pendenza_media']:>5.1f}% {r['pendenza_max']:>5.1f}% "
+              f"{r['difficolta']:>6.0f}  {r['livello']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Catalogo delle salite di tutto l'archivio")
+    sub = parser.add_subparsers(dest='comando')
+    p_upd = sub.add_parser('aggiorna', help='aggiorna database ed export (default)')
+    p_upd.add_argument('--completo', action='store_true', help='ricalcola le salite di tutte le gare')
+    p_q = sub.add_parser('cerca', help='interroga il database')
+    p_q.add_argument('--min-km', type=float, help='lunghezza minima (km)')
+    p_q.add_argument('--min-pendenza', type=float, help='pendenza media minima (%%)')
+    p_q.add_argument('--min-pendenza-max', type=float, help='pendenza massima minima (%%)')
+    p_q.add_argument('--min-difficolta', type=float, help='difficoltà minima')
+    p_q.add_argument('--anno', type=int)
+    p_q.add_argument('--genere')
+    p_q.add_argument('--categoria')
+    p_q.add_argument('--disciplina')
+    p_q.add_argument('--gara', help='slug di una gara')
+    p_q.add_argument('--ordina', choices=ORDINAMENTI, default='difficolta')
+    p_q.add_argument('--crescente', action='store_true', help='ordine crescente')
+    p_q.add_argument('--limite', type=int, default=50, help='righe mostrate (0 = tutte)')
+    p_q.add_argument('--json', action='store_true', help='stampa le righe in JSON')
+    args = parser.parse_args()
+
+    if not JSON_DIR.exists():
+        print(f"[FAIL] Cartella gare-sorgenti non trovata: {JSON_DIR}")
+        return 1
+
+    with closing(open_db()) as db:
+        if args.comando == 'cerca':
+            update_db(db, log=lambda *_: None)     # solo i GPX cambiati, senza output
+            rows = query_climbs(db, min_km=args.min_km, min_pendenza=args.min_pendenza,
+                                min_pendenza_max=args.min_pendenza_max,
+                                min_difficolta=args.min_difficolta, anno=args.anno,
+                                genere=args.genere, categoria=args.categoria,
+                                disciplina=args.disciplina, slug=args.gara,
+                                ordina=args.ordina, crescente=args.crescente,
+                                limite=args.limite or None)
+            if args.json:
+                print(json.dumps([dict(r) for r in rows], ensure_ascii=False, indent=2))
+            else:
+                print_rows(rows)
+            return 0
+
+        print(f"[*] Salite dell'archivio -> {DB_PATH}")
+        recomputed, total = update_db(db, full=getattr(args, 'completo', False))
+        exported = export_json(db)
+        print(f"[OK] {recomputed} gare ricalcolate, {total} salite; "
+              f"export di {exported} salite -> {EXPORT_PATH}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
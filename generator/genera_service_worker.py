@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+genera_service_worker.py — Service worker per consultare l'archivio anche offline.
+
+Uso (dopo astro build, sul sito già generato in dist/):
+    python generator/genera_service_worker.py
+    python generator/genera_service_worker.py --dist percorso/del/sito
+
+Scrive dist/sw.js con dentro il manifest di precache: per ogni file, il suo
+percorso relativo e l'hash del contenuto (preso da public/impronte.json di
+genera_manifest.py per i file copiati da public/, calcolato qui per le pagine
+di Astro). Il service worker:
+  - all'installazione scarica solo la "shell", di dimensione fissa: pagina indice,
+    asset di Astro, manifest e prima pagina del catalogo; le librerie esterne
+    (Leaflet, d3, font) usate da pagine e report sono tentate senza bloccare;
+  - salva report, pagine gara, GPX, miniature e le altre pagine del catalogo la
+    prima volta che vengono aperti, così una gara già vista si riapre subito anche
+    senza rete. Tutto in precache crescerebbe con l'archivio, e un solo file non
+    raggiungibile farebbe fallire l'installazione;
+  - a ogni deploy riusa le risposte con lo stesso hash e riscarica solo i file
+    cambiati (anche quelli salvati all'apertura), poi elimina la cache vecchia;
+  - tile della mappa e della heatmap: cache a parte, con un numero massimo di voci.
+
+Le chiavi della cache contengono l'hash (…/gare/x.html?rev=<hash>): una voce
+vecchia non può essere scambiata per quella nuova. Stessi file, stesso sw.js,
+byte per byte: il browser lo considera cambiato solo se è cambiato qualcosa.
+"""
+
+import re
+import sys
+import json
+import hashlib
+import argparse
+from fnmatch import fnmatch
+from pathlib import Path
+
+from cache_tracce import file_digest
+from archivio_io import write_text_atomic
+
+ARCHIVIO_DIR  = Path(__file__).parent.parent
+DIST_DIR      = ARCHIVIO_DIR / 'dist'
+MANIFEST_PATH = ARCHIVIO_DIR / 'public' / 'impronte.json'
+TEMPLATE_PATH = Path(__file__).parent / 'index.html'
+
+CIFRE_HASH = 16            # come genera_manifest.py
+
+# Scaricati all'installazione: pochi file, che non crescono con l'archivio
+PRECACHE_SEMPRE = ('index.html', 'assets/*', 'catalogo/manifest.json', 'catalogo/pagina-000.json',
+                   'anteprime/indice.json', 'tiles/heatmap/meta.json')
+# Salvati alla prima apertura, poi aggiornati a ogni deploy se cambiano
+PRECACHE_SU_RICHIESTA = ('gare/*.html', 'gare/*/index.html', 'gpx/*.gpx',
+                         'catalogo/*.json', 'anteprime/*.svg')
+
+TILE_MAX = 200             # tile di mappa e heatmap tenute offline (le più recenti)
+
+TAG_RE  = re.compile(r'<(script|link)\b[^>]*>', re.IGNORECASE)
+ATTR_RE = re.compile(r'\b(src|href|rel)\s*=\s*"([^"]*)"', re.IGNORECASE)
+
+
+# ── MANIFEST ──────────────────────────────────────────────────────────────────
+
+def load_hashes() -> dict[str, str]:
+    """Hash dei file di public/ da impronte.json (vuoto se non generato)."""
+    try:
+        entries = json.loads(MANIFEST_PATH.read_text(encoding='utf-8'))['file']
+    except (OSError, ValueError, KeyError):
+        return {}
+    return {rel: e['hash'] for rel, e in entries.items()}
+
+
+def collect(dist: Path, patterns: tuple[str, ...], known: dict[str, str]) -> dict[str, str]:
+    """percorso relativo → hash dei file di `dist` che corrispondono a `patterns`."""
+    out = {}
+    for p in sorted(dist.rglob('*')):
+        rel = p.relative_to(dist).as_posix()
+        if not p.is_file() or not any(fnmatch(rel, pat) and rel.count('/') == pat.count('/')
+                                       for pat in patterns):
+            continue
+        out[rel] = known.get(rel) or file_digest(p)[:CIFRE_HASH]
+    return out
+
+
+def external_assets(html_files: list[Path]) -> list[str]:
+    """URL https di <script src> e <link rel=stylesheet> nelle pagine date."""
+    urls = set()
+    for path in html_files:
+        for tag in TAG_RE.finditer(path.read_text(encoding='utf-8', errors='replace')):
+            attrs = {k.lower(): v for k, v in ATTR_RE.findall(tag.group(0))}
+            url = attrs.get('src') if tag.group(1).lower() == 'script' else (
+                attrs.get('href') if 'stylesheet' in attrs.get('rel', '').lower() else None)
+            if url and url.startswith('https://'):
+                urls.add(url)
+    return sorted(urls)
+
+
+# ── SERVICE WORKER ────────────────────────────────────────────────────────────
+
+SW_TEMPLATE = r"""// Generato da generator/genera_service_worker.py: non modificare a mano.
+const VERSIONE = '%(versione)s';
+const PRECACHE = %(sempre)s;
+const SU_RICHIESTA = %(su_richiesta)s;
+const CDN = %(cdn)s;
+const TILE_MAX = %(tile_max)d;
+
+const PREFISSO = 'archivio-precache-';
+const CACHE_PRECACHE = PREFISSO + VERSIONE;
+const CACHE_CDN = 'archivio-cdn';
+const CACHE_TILE = 'archivio-tile';
+const SCOPE = self.registration.scope;
+const CDN_HOSTS = new Set(CDN.map(u => new URL(u).host).concat(['fonts.gstatic.com']));
+const TILE_RE = /(^|\.)tile\.openstreetmap\.org$|^server\.arcgisonline\.com$/;
+
+function revKey(rel, hash) {
+    return new URL(rel, SCOPE).href + '?rev=' + hash;
+}
+
+// Percorso relativo allo scope come nel manifest: cartelle → index.html
+function relPath(url) {
+    let rel = decodeURIComponent(url.pathname.slice(new URL(SCOPE).pathname.length));
+    if (rel === '' || rel.endsWith('/')) rel += 'index.html';
+    else if (!rel.split('/').pop().includes('.')) rel += '/index.html';
+    return rel;
+}
+
+async function fetchAndPut(cache, rel, hash) {
+    const res = await fetch(new URL(rel, SCOPE).href, { cache: 'no-cache' });
+    if (!res.ok) throw new Error(rel + ': HTTP ' + res.status);
+    await cache.put(revKey(rel, hash), res);
+}
+
+self.addEventListener('install', event => {
+    event.waitUntil((async () => {
+        const cache = await caches.open(CACHE_PRECACHE);
+        const old = [];
+        for (const name of await caches.keys()) {
+            if (name.startsWith(PREFISSO) && name !== CACHE_PRECACHE) old.push(await caches.open(name));
+        }
+        async function fromOld(key) {
+            for (const c of old) {
+                const res = await c.match(key);
+                if (res) return res;
+            }
+            return null;
+        }
+        // Shell: hash invariato → copia dalla cache vecchia, altrimenti rete
+        await Promise.all(Object.entries(PRECACHE).map(async ([rel, hash]) => {
+            const res = await fromOld(revKey(rel, hash));
+            if (res) await cache.put(revKey(rel, hash), res);
+            else await fetchAndPut(cache, rel, hash);
+        }));
+        // File salvati all'apertura: si portano avanti, riscaricando quelli cambiati.
+        // Best effort: uno non raggiungibile si riscarica alla prossima apertura
+        const seen = new Set();
+        const carried = [];
+        for (const c of old) {
+            for (const req of await c.keys()) {
+                const url = new URL(req.url);
+                const rel = relPath(url);
+                const hash = SU_RICHIESTA[rel];
+                if (!hash || seen.has(rel)) continue;
+                seen.add(rel);
+                carried.push(url.searchParams.get('rev') === hash
+                    ? c.match(req).then(res => cache.put(revKey(rel, hash), res))
+                    : fetchAndPut(cache, rel, hash));
+            }
+        }
+        await Promise.allSettled(carried);
+        // Librerie esterne: best effort, si riprovano comunque al primo uso
+        const cdn = await caches.open(CACHE_CDN);
+        await Promise.all(CDN.map(async url => {
+            if (await cdn.match(url)) return;
+            try { await cdn.put(url, await fetch(new Request(url, { mode: 'no-cors' }))); } catch (err) {}
+        }));
+        await self.skipWaiting();
+    })());
+});
+
+self.addEventListener('activate', event => {
+    event.waitUntil((async () => {
+        for (const name of await caches.keys()) {
+            if (name.startsWith(PREFISSO) && name !== CACHE_PRECACHE) await caches.delete(name);
+        }
+        await self.clients.claim();
+    })());
+});
+
+async function fromPrecache(req, rel, hash) {
+    const cache = await caches.open(CACHE_PRECACHE);
+    const hit = await cache.match(revKey(rel, hash));
+    if (hit) return hit;
+    const res = await fetch(req);
+    if (res.ok && !res.redirected) await cache.put(revKey(rel, hash), res.clone());
+    return res;
+}
+
+async function staleWhileRevalidate(event, cacheName) {
+    const cache = await caches.open(cacheName);
+    const hit = await cache.match(event.request);
+    const update = fetch(event.request).then(res => {
+        if (res.ok || res.type === 'opaque') return cache.put(event.request, res.clone()).then(() => res);
+        return res;
+    });
+    if (!hit) return update;
+    event.waitUntil(update.catch(() => {}));
+    return hit;
+}
+
+async function cacheFirstTile(req) {
+    const cache = await caches.open(CACHE_TILE);
+    const hit = await cache.match(req);
+    if (hit) return hit;
+    const res = await fetch(req);
+    if (res.ok || res.type === 'opaque') {
+        await cache.put(req, res.clone());
+        const keys = await cache.keys();
+        for (let i = 0; i < keys.length - TILE_MAX; i++) await cache.delete(keys[i]);
+    }
+    return res;
+}
+
+self.addEventListener('fetch', event => {
+    const req = event.request;
+    if (req.method !== 'GET') return;
+    const url = new URL(req.url);
+    if (url.origin === self.location.origin) {
+        if (!url.href.startsWith(SCOPE)) return;
+        const rel = relPath(url);
+        const hash = PRECACHE[rel] || SU_RICHIESTA[rel];
+        if (hash) event.respondWith(fromPrecache(req, rel, hash));
+        else if (rel.startsWith('tiles/')) event.respondWith(cacheFirstTile(req));
+        return;
+    }
+    if (CDN_HOSTS.has(url.host)) event.respondWith(staleWhileRevalidate(event, CACHE_CDN));
+    else if (TILE_RE.test(url.host)) event.respondWith(cacheFirstTile(req));
+});
+"""
+
+
+def render_service_worker(sempre: dict, su_richiesta: dict, cdn: list[str]) -> str:
+    """Sorgente di sw.js; VERSIONE è l'hash di tutto il manifest."""
+    def js(value):
+        return json.dumps(value, indent=1, sort_keys=True, ensure_ascii=False)
+    payload = js({'sempre': sempre, 'su_richiesta': su_richiesta, 'cdn': cdn})
+    versione = hashlib.sha256(payload.encode('utf-8')).hexdigest()[:CIFRE_HASH]
+    return SW_TEMPLATE % {
+        'versione': versione,
+        'sempre': js(sempre),
+        'su_richiesta': js(su_richiesta),
+        'cdn': js(cdn),
+        'tile_max': TILE_MAX,
+    }
+
+
+def build_service_worker(dist: Path) -> tuple[dict, dict, list[str]]:
+    """Scrive dist/sw.js; ritorna (shell, file su richiesta, librerie esterne)."""
+    known = load_hashes()
+    sempre = collect(dist, PRECACHE_SEMPRE, known)
+    su_richiesta = {rel: h for rel, h in collect(dist, PRECACHE_SU_RICHIESTA, known).items()
+                    if rel not in sempre}
+    pages = [dist / rel for rel in (*sempre, *su_richiesta) if rel.endswith('index.html')]
+    cdn = external_assets(pages + [TEMPLATE_PATH])
+    write_text_atomic(dist / 'sw.js', render_service_worker(sempre, su_richiesta, cdn),
+                      skip_unchanged=True)
+    return sempre, su_richiesta, cdn
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Genera il service worker per la consultazione offline')
+    parser.add_argument('--dist', type=Path, default=DIST_DIR, help='cartella del sito generato da Astro')
+    args = parser.parse_args()
+
+    if not (args.dist / 'index.html').exists():
+        print(f"[FAIL] Sito non trovato in {args.dist} (lanciare prima astro build)")
+        return 1
+    if not MANIFEST_PATH.exists():
+        print(f"[WARN] {MANIFEST_PATH.name} mancante: hash calcolati su tutti i file")
+
+    sempre, su_richiesta, cdn = build_service_worker(args.dist)
+    print(f"[*] Shell: {len(sempre)} file, su richiesta: {len(su_richiesta)} file, esterni: {len(cdn)}")
+    print(f"[OK] Service worker -> {args.dist / 'sw.js'}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+geocodifica_archivio.py — Ricalcola il campo `luogo` di tutte le gare via Nominatim.
+
+Uso:
+    python generator/geocodifica_archivio.py                  # tutto l'archivio
+    python generator/geocodifica_archivio.py --solo-mancanti  # solo gare senza luogo
+    python generator/geocodifica_archivio.py --dry-run        # mostra, non scrive
+    python generator/geocodifica_archivio.py --url http://127.0.0.1:8080   # server locale
+
+Il punto centrale di ogni public/gpx/<slug>.gpx viene messo in coda; i punti
+entro --raggio km da uno già in coda (o già risolto) condividono la stessa
+richiesta. La coda rispetta la policy di Nominatim (max 1 richiesta/s) e ogni
+risultato è salvato subito in .cache/geocodifica.json: se lo script viene
+interrotto, al giro successivo riparte da dove si era fermato. Il limite vale
+anche insieme a servizio_ingest.py acceso: i due condividono RateLimiter.
+"""
+
+import sys
+import json
+import time
+import argparse
+import urllib.error
+from collections import deque
+from pathlib import Path
+
+from traccia import haversine
+from cache_tracce import cached_analysis
+from genera_report import NOMINATIM_URL, nominatim_reverse, format_luogo, gara_json
+from archivio_io import archive_lock, file_lock, write_text_atomic
+
+ARCHIVIO_DIR    = Path(__file__).parent.parent
+JSON_DIR        = ARCHIVIO_DIR / 'gare-sorgenti'
+GPX_DIR         = ARCHIVIO_DIR / 'public' / 'gpx'
+CHECKPOINT_PATH = ARCHIVIO_DIR / '.cache' / 'geocodifica.json'
+LIMITER_PATH    = ARCHIVIO_DIR / '.cache' / 'nominatim.lock'
+
+INTERVALLO_S = 1.0     # policy Nominatim: al massimo una richiesta al secondo
+RAGGIO_KM    = 5.0     # punti più vicini di così condividono la richiesta
+TENTATIVI    = 3
+
+
+class RateLimiter:
+    """
+    Garantisce almeno `interval` secondi tra due chiamate a wait(), anche tra
+    processi diversi (questo script, il servizio di ingest): l'ora dell'ultima
+    richiesta sta in .cache/nominatim.lock, letta e aggiornata sotto file_lock.
+    """
+
+    def __init__(self, interval: float = INTERVALLO_S, path: Path = LIMITER_PATH):
+        self.interval = interval
+        self.path = path
+
+    def wait(self):
+        with file_lock(self.path) as f:
+            f.seek(0)
+            try:
+                last = float(f.read().decode('ascii'))
+            except ValueError:
+                last = None
+            now = time.time()
+            if last is not None:
+                # Limitata a `interval`: un orologio spostato indietro non blocca tutto
+                delay = min(last + self.interval - now, self.interval)
+                if delay > 0:
+                    time.sleep(delay)
+                    now = time.time()
+            f.truncate(0)
+            f.write(repr(now).encode('ascii'))
+            f.flush()
+
+
+# ── CHECKPOINT ────────────────────────────────────────────────────────────────
+
+def load_checkpoint(base_url: str) -> dict:
+    """Risultati già ottenuti da questo server: {slug: {'coord': [lat, lon], 'luogo': ...}}."""
+    try:
+        data = json.loads(CHECKPOINT_PATH.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+    if data.get('url') != base_url:
+        return {}
+    return data.get('gare', {})
+
+
+def save_checkpoint(base_url: str, done: dict):
+    write_text_atomic(CHECKPOINT_PATH, json.dumps({'url': base_url, 'gare': done}, ensure_ascii=False,
+                                                  indent=2, sort_keys=True))
+
+
+# ── CODA ──────────────────────────────────────────────────────────────────────
+
+def collect_targets(only_missing: bool) -> dict:
+    """{slug: (lat, lon)} delle gare da geocodificare."""
+    targets = {}
+    for json_path in sorted(JSON_DIR.glob('*.json')):
+        gara = json.loads(json_path.read_text(encoding='utf-8'))
+        slug = json_path.stem
+        if only_missing and gara.get('luogo'):
+            continue
+        gpx_path = GPX_DIR / f"{slug}.gpx"
+        if not gpx_path.exists():
+            print(f"  [SKIP] {slug}: GPX mancante ({gpx_path.name})")
+            continue
+        analysis = cached_analysis(gpx_path)
+        if analysis.center_lat is None:
+            print(f"  [SKIP] {slug}: GPX senza punti")
+            continue
+        targets[slug] = (round(analysis.center_lat, 5), round(analysis.center_lon, 5))
+    return targets
+
+
+def build_queue(pending: dict, done: dict, radius_km: float) -> deque:
+    """
+    Raggruppa le gare in attesa attorno a centri comuni.
+    Ritorna una deque di (coord, [slug, ...]); le gare vicine a un risultato
+    già noto vengono risolte subito in `done` senza richiesta.
+    """
+    known = [(tuple(v['coord']), v['luogo']) for v in done.values()]
+    clusters: list[tuple[tuple, list]] = []
+    for slug, coord in pending.items():
+        hit = next((luogo for c, luogo in known
+                    if haversine(*c, *coord) <= radius_km * 1000), False)
+        if hit is not False:
+            done[slug] = {'coord': list(coord), 'luogo': hit}
+            continue
+        for center, slugs in clusters:
+            if haversine(*center, *coord) <= radius_km * 1000:
+                slugs.append(slug)
+                break
+        else:
+            clusters.append((coord, [slug]))
+    return deque(clusters)
+
+
+def geocode_with_retry(coord, base_url: str, limiter: RateLimiter) -> str | None:
+    """Una richiesta (con retry sugli errori temporanei). Solleva se tutti falliscono."""
+    # L'attesa prima di riprovare non scende sotto quella della policy, anche
+    # con --intervallo più basso (server locale)
+    backoff = max(limiter.interval, INTERVALLO_S)
+    for attempt in range(1, TENTATIVI + 1):
+        limiter.wait()
+        try:
+            return format_luogo(nominatim_reverse(*coord, base_url=base_url, timeout=10))
+        except urllib.error.HTTPError as e:
+            if e.code not in (429, 500, 502, 503, 504) or attempt == TENTATIVI:
+                raise
+            # Il server chiede di rallentare: attesa crescente prima di riprovare
+            time.sleep(backoff * 5 * attempt)
+        except (urllib.error.URLError, TimeoutError):
+            if attempt == TENTATIVI:
+                raise
+            time.sleep(backoff * 2 * attempt)
+
+
+def apply_results(done: dict, slugs, dry_run: bool) -> int:
+    """
+    Scrive i luoghi trovati nei JSON. Ritorna il numero di gare modificate.
+    Lettura e riscrittura di ogni JSON avvengono sotto il lock dell'archivio.
+    """
+    changed = 0
+    for slug in sorted(slugs):
+        luogo = done[slug]['luogo']
+        json_path = JSON_DIR / f"{slug}.json"
+        with archive_lock():
+            gara = json.loads(json_path.read_text(encoding='utf-8'))
+            if not luogo or gara.get('luogo') == luogo:
+                continue
+            print(f"  {slug}: {gara.get('luogo') or '—'} → {luogo}")
+            changed += 1
+            if not dry_run:
+                gara['luogo'] = luogo
+                write_text_atomic(json_path, gara_json(gara))
+    return changed
+
+
+# ── MAIN ──────────────────────────────────────────────────────────────────────
+
+def main():
+    parser = argparse.ArgumentParser(description='Geocodifica in blocco il luogo delle gare')
+    parser.add_argument('--solo-mancanti', action='store_true', help='solo gare senza luogo')
+    parser.add_argument('--dry-run', action='store_true', help='mostra i cambiamenti senza scrivere i JSON')
+    parser.add_argument('--url', default=NOMINATIM_URL, help='server Nominatim (default: OSM pubblico)')
+    parser.add_argument('--intervallo', type=float, default=INTERVALLO_S, help=f'secondi minimi tra due richieste (almeno {INTERVALLO_S:g} sul server pubblico)')
+    parser.add_argument('--raggio', type=float, default=RAGGIO_KM, help='km entro cui riusare la stessa richiesta')
+    parser.add_argument('--ricomincia', action='store_true', help='ignora il checkpoint precedente')
+    args = parser.parse_args()
+
+    if not JSON_DIR.exists():
+        print(f"[FAIL] Cartella gare-sorgenti non trovata: {JSON_DIR}")
+        return 1
+    if args.url == NOMINATIM_URL and args.intervallo < INTERVALLO_S:
+        # Sul server pubblico la policy vale comunque: niente intervalli più brevi
+        print(f"[WARN] --intervallo {args.intervallo:g} sotto il limite di Nominatim: uso {INTERVALLO_S:g} s")
+        args.intervallo = INTERVALLO_S
+    args.intervallo = max(args.intervallo, 0.0)
+
+    targets = collect_targets(args.solo_mancanti)
+    done = {} if args.ricomincia else load_checkpoint(args.url)
+    # Un risultato vale solo se il GPX non si è spostato nel frattempo
+    done = {s: v for s, v in done.items() if s not in targets or tuple(v['coord']) == targets[s]}
+    pending = {s: c for s, c in targets.items() if s not in done}
+
+    queue = build_queue(pending, done, args.raggio)
+    print(f"[*] {len(targets)} gare, {len(targets) - len(pending)} già risolte, "
+          f"{len(queue)} richieste in coda ({args.url})")
+
+    limiter = RateLimiter(args.intervallo)
+    failed = 0
+    try:
+        while queue:
+            coord, slugs = queue.popleft()
+            try:
+                luogo = geocode_with_retry(coord, args.url, limiter)
+            except Exception as e:
+                print(f"  [FAIL] {', '.join(slugs)}: {e}")
+                failed += 1
+                continue
+            for slug in slugs:
+                done[slug] = {'coord': list(targets[slug]), 'luogo': luogo}
+            save_checkpoint(args.url, done)
+            print(f"  [OK] {', '.join(slugs)}: {luogo or '—'}")
+    except KeyboardInterrupt:
+        save_checkpoint(args.url, done)
+        print(f"\n[*] Interrotto: {len(queue) + 1} richieste rimaste, riprende al prossimo avvio.")
+        return 130
+
+    save_checkpoint(args.url, done)
+    changed = apply_results(done, targets.keys() & done.keys(), args.dry_run)
+    verb = "da aggiornare" if args.dry_run else "aggiornate"
+    print(f"\n[*] Risultato: {changed} gare {verb}, {failed} richieste fallite")
+    return 0 if failed == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -22,14 +22,14 @@ Lo script:
 import sys
 import re
 import json
-import math
 import base64
 import argparse
 import subprocess
-import xml.etree.ElementTree as ET
 from pathlib import Path
 from datetime import date
 
+from traccia import RouteTrack, RouteAnalysis
+
 # ── CONFIGURAZIONE ───────────────────────────────────────────────────────────
 ARCHIVIO_DIR = Path(__file__).parent.parent
 # ─────────────────────────────────────────────────────────────────────────────
@@ -48,75 +48,10 @@ DISCIPLINE = ["Strada", "Criterium", "Cronometro"]
 def parse_gpx(gpx_path: Path) -> dict:
     """Estrae distanza (km) e dislivello positivo (m) dal file GPX."""
     try:
-        tree = ET.parse(gpx_path)
-        root = tree.getroot()
-        ns = ''
-        if root.tag.startswith('{'):
-            ns = root.tag.split('}')[0] + '}'
-
-        points = root.findall(f'.//{ns}trkpt')
-        if not points:
-            points = root.findall(f'.//{ns}rtept')
-
-        if not points:
-            return {'distanza_km': None, 'dislivello_m': None}
-
-        coords = []
-        for pt in points:
-            try:
-                lat = float(pt.get('lat'))
-                lon = float(pt.get('lon'))
-                ele_el = pt.find(f'{ns}ele')
-                ele = float(ele_el.text) if ele_el is not None else None
-                coords.append((lat, lon, ele))
-            except (TypeError, ValueError):
-                continue
-
-        if not coords:
-            return {'distanza_km': None, 'dislivello_m': None}
-
-        def haversine(lat1, lon1, lat2, lon2):
-            R = 6371000
-            φ1, φ2 = math.radians(lat1), math.radians(lat2)
-            dφ = math.radians(lat2 - lat1)
-            dλ = math.radians(lon2 - lon1)
-            a = math.sin(dφ/2)**2 + math.cos(φ1)*math.cos(φ2)*math.sin(dλ/2)**2
-            return R * 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-
-        dist_m = sum(
-            haversine(coords[i][0], coords[i][1], coords[i+1][0], coords[i+1][1])
-            for i in range(len(coords)-1)
-        )
-
-        # Smoothing quote con media mobile (finestra 5) per ridurre rumore GPS
-        eles_raw = [c[2] for c in coords if c[2] is not None]
-        w = 5
-        eles = []
-        for i in range(len(eles_raw)):
-            start = max(0, i - w // 2)
-            end   = min(len(eles_raw), i + w // 2 + 1)
-            eles.append(sum(eles_raw[start:end]) / (end - start))
-
-        d_plus = 0.0
-        for i in range(1, len(eles)):
-            diff = eles[i] - eles[i-1]
-            if diff > 0:
-                d_plus += diff
-
-        # Punto centrale per il geocoding
-        mid = coords[len(coords) // 2]
-        center_lat, center_lon = mid[0], mid[1]
-
-        return {
-            'distanza_km': round(dist_m / 1000, 2),
-            'dislivello_m': round(d_plus) if d_plus > 0 else None,
-            'center_lat':   center_lat,
-            'center_lon':   center_lon,
-        }
-
+        return RouteTrack.from_gpx(gpx_path).analyze().as_dict()
     except Exception as e:
         print(f"  Avviso: impossibile leggere dati dal GPX ({e})")
-        return {'distanza_km': None, 'dislivello_m': None, 'center_lat': None, 'center_lon': None}
+        return RouteAnalysis().as_dict()
 
 
 # ── REVERSE GEOCODING ─────────────────────────────────────────────────────────
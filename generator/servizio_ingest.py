@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""
+servizio_ingest.py — Servizio HTTP locale per aggiungere gare, alternativo al dialog Tk.
+
+Uso:
+    python generator/servizio_ingest.py                          # http://127.0.0.1:8765
+    python generator/servizio_ingest.py --host 0.0.0.0 --token segreto
+    python generator/servizio_ingest.py --worker 4
+
+Endpoint:
+  GET  /          form di caricamento (per il browser)
+  POST /analisi   multipart con il campo `gpx`: distanza, D+ e luogo, senza scrivere nulla
+  POST /gare      multipart con `gpx` e i metadati di genera_report (titolo, slug, data,
+                  genere, categoria, disciplina, giri, distanza_km, dislivello_m, luogo,
+                  note, sovrascrivi): aggiunge la gara all'archivio
+
+Le risposte sono JSON. I campi mancanti prendono i default del dialog Tk
+(titolo = nome del file, slug dal titolo, data di oggi, statistiche dal GPX
+moltiplicate per i giri, luogo dal geocoding). /gare risponde 201 se la gara
+è stata aggiunta, 400 se i metadati non sono validi, 409 se lo slug esiste già.
+
+Il parsing del GPX e la generazione del report girano in un pool di processi,
+così il servizio regge molti caricamenti in contemporanea; la scrittura usa
+save_race() di genera_report, cioè lo stesso lock e le stesse scritture
+atomiche dell'importazione da dialog. Il geocoding passa da un'unica coda con
+al massimo una richiesta al secondo (policy Nominatim), condivisa con
+geocodifica_archivio.py anche se gira in parallelo, e ricorda i risultati.
+
+Con --token ogni POST deve avere l'header "Authorization: Bearer <token>"
+oppure il campo `token` come prima parte del multipart: il form di GET / lo chiede
+e lo invia per primo. Senza token la richiesta è respinta prima di leggere il file.
+"""
+
+import os
+import re
+import sys
+import hmac
+import json
+import email
+import email.policy
+import asyncio
+import argparse
+import tempfile
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from pathlib import Path
+
+from cache_tracce import cached_analysis
+from archivio_io import SlugTakenError
+from geocodifica_archivio import INTERVALLO_S, RateLimiter
+from genera_report import (GENERI, CATEGORIE, DISCIPLINE, NOMINATIM_URL, num_or_none,
+                           reverse_geocode, save_race, slugify, validate_meta)
+
+ARCHIVIO_DIR = Path(__file__).parent.parent
+UPLOAD_DIR   = ARCHIVIO_DIR / '.cache' / 'ingest'
+
+PORTA = 8765
+MAX_UPLOAD_MB = 25
+TIMEOUT_S = 60           # per leggere una richiesta intera
+TOKEN_PREFISSO = 4096    # byte letti al massimo per trovare il campo `token`
+MAX_GIRI = 50            # come lo Spinbox "Giri del circuito" di genera_report
+
+
+# ── LAVORI NEL POOL (processi separati) ──────────────────────────────────────
+
+def _analyze_job(gpx_path: str) -> dict:
+    """Riepilogo del GPX caricato (passa dalla cache delle tracce)."""
+    return cached_analysis(Path(gpx_path)).as_dict()
+
+
+def _save_job(meta: dict, gpx_path: str, overwrite: bool) -> dict:
+    paths = save_race(meta, Path(gpx_path), overwrite=overwrite)
+    return {k: str(v.relative_to(ARCHIVIO_DIR)) for k, v in paths.items()}
+
+
+# ── GEOCODING ────────────────────────────────────────────────────────────────
+
+class Geocoder:
+    """
+    Geocoding inverso condiviso tra le richieste: una chiamata alla volta, ad
+    almeno `interval` secondi dalla precedente anche fatta da un altro processo
+    (RateLimiter di geocodifica_archivio), con i risultati in memoria
+    (stessa gara caricata da più persone = una sola richiesta).
+    """
+
+    def __init__(self, base_url: str = NOMINATIM_URL, interval: float = INTERVALLO_S):
+        self.base_url = base_url
+        self.limiter = RateLimiter(interval)
+        self._lock = asyncio.Lock()
+        self._cache: dict[tuple[float, float], str | None] = {}
+
+    async def luogo(self, lat: float, lon: float) -> str | None:
+        key = (round(lat, 3), round(lon, 3))
+        if key in self._cache:
+            return self._cache[key]
+        async with self._lock:
+            if key in self._cache:          # risolto mentre si era in coda
+                return self._cache[key]
+            loop = asyncio.get_running_loop()
+            luogo = await loop.run_in_executor(None, self._fetch, lat, lon)
+            if luogo:                       # None = offline: si riprova alla prossima
+                self._cache[key] = luogo
+            return luogo
+
+    def _fetch(self, lat: float, lon: float) -> str | None:
+        self.limiter.wait()
+        return reverse_geocode(lat, lon, self.base_url)
+
+
+# ── HTTP ─────────────────────────────────────────────────────────────────────
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str, **extra):
+        super().__init__(message)
+        self.status = status
+        self.body = {'errore': message, **extra}
+
+
+REASONS = {200: 'OK', 201: 'Created', 400: 'Bad Request', 401: 'Unauthorized',
+           404: 'Not Found', 405: 'Method Not Allowed', 409: 'Conflict',
+           413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+async def read_head(reader: asyncio.StreamReader) -> tuple[str, str, dict, int]:
+    """(metodo, percorso, header in minuscolo, lunghezza del corpo) di una richiesta HTTP/1.1."""
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        method, target, _ = lines[0].split(' ', 2)
+    except ValueError:
+        raise HttpError(400, 'richiesta non valida')
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise HttpError(400, 'Content-Length non valido')
+    if length < 0:
+        raise HttpError(400, 'Content-Length non valido')
+    if length > MAX_UPLOAD_MB * 1024 * 1024:
+        raise HttpError(413, f'file oltre {MAX_UPLOAD_MB} MB')
+    return method, target.split('?', 1)[0], headers, length
+
+
+async def read_body(reader: asyncio.StreamReader, length: int, start: bytes = b'') -> bytes:
+    """Resto del corpo, dopo i byte `start` già letti."""
+    rest = length - len(start)
+    return start + (await asyncio.wait_for(reader.readexactly(rest), TIMEOUT_S) if rest else b'')
+
+
+def multipart_boundary(content_type: str) -> str:
+    if not content_type.startswith('multipart/form-data'):
+        raise HttpError(400, 'atteso multipart/form-data')
+    msg = email.message_from_string(f'Content-Type: {content_type}\r\n\r\n', policy=email.policy.HTTP)
+    boundary = msg.get_boundary()
+    if not boundary:
+        raise HttpError(400, 'corpo multipart non valido')
+    return boundary
+
+
+def first_field(start: bytes, boundary: str) -> tuple[str, str] | None:
+    """(nome, valore) della prima parte multipart se è un campo di testo completo in `start`."""
+    sep = re.escape(b'--' + boundary.encode('latin-1'))
+    m = re.match(sep + rb'\r\n(.*?)\r\n\r\n(.*?)\r\n' + sep, start, re.DOTALL)
+    if not m:
+        return None
+    part = email.message_from_bytes(m.group(1) + b'\r\n\r\n', policy=email.policy.HTTP)
+    name = part.get_param('name', header='content-disposition')
+    if not name or part.get_filename() is not None:
+        return None
+    return name, m.group(2).decode('utf-8', errors='replace').strip()
+
+
+def parse_multipart(content_type: str, body: bytes) -> tuple[dict[str, str], dict[str, tuple[str, bytes]]]:
+    """({campo: testo}, {campo: (nome file, byte)}) di un corpo multipart/form-data."""
+    multipart_boundary(content_type)
+    msg = email.message_from_bytes(f'Content-Type: {content_type}\r\n\r\n'.encode('latin-1') + body,
+                                   policy=email.policy.HTTP)
+    if not msg.is_multipart():
+        raise HttpError(400, 'corpo multipart non valido')
+    fields, files = {}, {}
+    for part in msg.iter_parts():
+        name = part.get_param('name', header='content-disposition')
+        if not name:
+            continue
+        payload = part.get_payload(decode=True) or b''
+        filename = part.get_filename()
+        if filename is not None:
+            files[name] = (filename, payload)
+        else:
+            fields[name] = payload.decode('utf-8', errors='replace').strip()
+    return fields, files
+
+
+def response(status: int, body: bytes, content_type: str) -> bytes:
+    head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n")
+    return head.encode('latin-1') + body
+
+
+def json_response(status: int, data: dict) -> bytes:
+    return response(status, json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8'),
+                    'application/json; charset=utf-8')
+
+
+FORM_HTML = """<!doctype html>
+<html lang="it"><head><meta charset="utf-8"><meta name="viewport" content="width=device-width">
+<title>Aggiungi gara</title>
+<style>body{{font:15px system-ui;max-width:32rem;margin:2rem auto;padding:0 1rem}}
+label{{display:block;margin:.6rem 0 .2rem;font-weight:600}}input,select,textarea{{width:100%;padding:.35rem}}
+button{{margin-top:1rem;padding:.5rem 1rem}}</style></head><body>
+<h1>Aggiungi gara</h1>
+<form method="post" action="/gare" enctype="multipart/form-data">{token}
+<label>File GPX *</label><input type="file" name="gpx" accept=".gpx" required>
+<label>Nome gara</label><input name="titolo">
+<label>Slug URL</label><input name="slug">
+<label>Data</label><input type="date" name="data">
+<label>Genere</label><select name="genere">{genere}</select>
+<label>Categoria</label><select name="categoria">{categoria}</select>
+<label>Disciplina</label><select name="disciplina">{disciplina}</select>
+<label>Giri del circuito</label><input type="number" name="giri" min="1" max="50" value="1">
+<label>Luogo / Regione</label><input name="luogo" placeholder="dal GPX se vuoto">
+<label>Note</label><textarea name="note" rows="3"></textarea>
+<button>Aggiungi al database →</button>
+</form></body></html>
+"""
+
+
+TOKEN_FIELD = ('\n<label>Token *</label>'
+               '<input type="password" name="token" autocomplete="current-password" required>')
+
+
+def form_page(with_token: bool = False) -> bytes:
+    def options(values, default):
+        return ''.join(f'<option{" selected" if v == default else ""}>{v}</option>' for v in values)
+    return FORM_HTML.format(token=TOKEN_FIELD if with_token else '',
+                            genere=options(GENERI, 'Femminile'),
+                            categoria=options(CATEGORIE, 'Junior'),
+                            disciplina=options(DISCIPLINE, DISCIPLINE[0])).encode('utf-8')
+
+
+# ── SERVIZIO ─────────────────────────────────────────────────────────────────
+
+class IngestService:
+    def __init__(self, pool: ProcessPoolExecutor, geocoder: Geocoder, token: str | None = None):
+        self.pool = pool
+        self.geocoder = geocoder
+        self.token = token
+
+    async def run_in_pool(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.pool, fn, *args)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        peer = writer.get_extra_info('peername')
+        try:
+            try:
+                method, path, headers, length = await asyncio.wait_for(read_head(reader), TIMEOUT_S)
+                out = await self.route(method, path, headers, reader, length)
+            except HttpError as e:
+                out = json_response(e.status, e.body)
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+                out = json_response(400, {'errore': 'richiesta incompleta'})
+            except Exception as e:
+                # Dettagli solo nel log: possono contenere percorsi e dati interni
+                print(f"  [FAIL] {peer}: {e}")
+                traceback.print_exc()
+                out = json_response(500, {'errore': 'errore interno del servizio'})
+            writer.write(out)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method: str, path: str, headers: dict,
+                    reader: asyncio.StreamReader, length: int) -> bytes:
+        if path == '/':
+            if method != 'GET':
+                raise HttpError(405, 'metodo non ammesso')
+            return response(200, form_page(bool(self.token)), 'text/html; charset=utf-8')
+        if path not in ('/analisi', '/gare'):
+            raise HttpError(404, 'percorso sconosciuto')
+        if method != 'POST':
+            raise HttpError(405, 'metodo non ammesso')
+
+        content_type = headers.get('content-type', '')
+        # Il token si controlla prima di leggere il corpo (al più TOKEN_PREFISSO byte)
+        start = await self.check_token(headers, reader, content_type, length)
+        fields, files = parse_multipart(content_type, await read_body(reader, length, start))
+        if 'gpx' not in files or not files['gpx'][1]:
+            raise HttpError(400, 'campo gpx mancante')
+        filename, data = files['gpx']
+
+        # Il GPX va su disco: i worker lo leggono da lì e save_race lo copia
+        UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=UPLOAD_DIR, suffix='.gpx')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            gpx_data = await self.analyze(tmp)
+            if path == '/analisi':
+                luogo = await self.locate(gpx_data)
+                return json_response(200, {**gpx_data, 'luogo': luogo})
+            return await self.add_race(fields, filename, tmp, gpx_data)
+        finally:
+            os.unlink(tmp)
+
+    async def check_token(self, headers: dict, reader: asyncio.StreamReader,
+                          content_type: str, length: int) -> bytes:
+        """
+        Token nell'header Authorization (client, curl) o nel campo `token` (form),
+        che deve essere la prima parte del multipart: così una richiesta senza
+        token viene respinta dopo pochi byte, senza leggere né analizzare il file.
+        Ritorna i byte del corpo già letti.
+        """
+        if not self.token:
+            return b''
+        auth = headers.get('authorization', '')
+        if auth.startswith('Bearer '):
+            given, start = auth[len('Bearer '):], b''
+        else:
+            boundary = multipart_boundary(content_type)
+            start = await read_body(reader, min(length, TOKEN_PREFISSO))
+            name, given = first_field(start, boundary) or ('', '')
+            if name != 'token':
+                given = ''
+        if not given or not hmac.compare_digest(given.encode('utf-8'), self.token.encode('utf-8')):
+            raise HttpError(401, 'token mancante o errato')
+        return start
+
+    async def analyze(self, gpx_path: str) -> dict:
+        try:
+            gpx_data = await self.run_in_pool(_analyze_job, gpx_path)
+        except Exception as e:
+            raise HttpError(400, f'GPX illeggibile ({e})')
+        if gpx_data['distanza_km'] is None:
+            raise HttpError(400, 'GPX senza punti')
+        return gpx_data
+
+    async def locate(self, gpx_data: dict) -> str | None:
+        lat, lon = gpx_data.get('center_lat'), gpx_data.get('center_lon')
+        if lat is None or lon is None:
+            return None
+        return await self.geocoder.luogo(lat, lon)
+
+    async def add_race(self, fields: dict, filename: str, gpx_path: str, gpx_data: dict) -> bytes:
+        """Metadati con i default del dialog Tk, poi save_race() nel pool."""
+        try:
+            giri = int(fields.get('giri') or 1)
+        except ValueError:
+            giri = 0
+        if not 1 <= giri <= MAX_GIRI:
+            raise HttpError(400, 'metadati non validi', errori=[f"Giri tra 1 e {MAX_GIRI}"])
+
+        km = num_or_none(fields.get('distanza_km', ''))
+        if km is None and gpx_data['distanza_km']:
+            km = round(gpx_data['distanza_km'] * giri, 2)
+        d_plus = num_or_none(fields.get('dislivello_m', ''))
+        if d_plus is None and gpx_data['dislivello_m']:
+            d_plus = round(gpx_data['dislivello_m'] * giri)
+
+        titolo = fields.get('titolo') or Path(filename).stem
+        meta = {
+            "slug":         slugify(fields.get('slug') or titolo),
+            "titolo":       titolo,
+            "data":         fields.get('data') or date.today().isoformat(),
+            "genere":       fields.get('genere') or "Femminile",
+            "categoria":    fields.get('categoria') or "Junior",
+            "disciplina":   fields.get('disciplina') or DISCIPLINE[0],
+            "distanza_km":  km,
+            "dislivello_m": d_plus,
+            "luogo":        fields.get('luogo') or None,
+            "note":         fields.get('note') or None,
+        }
+        errors = validate_meta(meta)
+        if errors:
+            raise HttpError(400, 'metadati non validi', errori=errors)
+        if meta["luogo"] is None:
+            meta["luogo"] = await self.locate(gpx_data)
+
+        overwrite = fields.get('sovrascrivi', '').lower() in ('1', 'true', 'si', 'sì', 'on')
+        try:
+            files = await self.run_in_pool(_save_job, meta, gpx_path, overwrite)
+        except SlugTakenError as e:
+            raise HttpError(409, str(e), slug=e.slug)
+        print(f"  [OK] {meta['slug']}: {meta['titolo']} ({km} km, +{d_plus} m, {meta['luogo']})")
+        return json_response(201, {**{k: v for k, v in meta.items() if v is not None},
+                                   'file': files})
+
+
+# ── MAIN ──────────────────────────────────────────────────────────────────────
+
+async def serve(host: str, port: int, workers: int | None, token: str | None, nominatim: str):
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        service = IngestService(pool, Geocoder(nominatim), token)
+        server = await asyncio.start_server(service.handle, host, port)
+        print(f"[OK] Servizio ingest su http://{host}:{port}/ "
+              f"({workers} worker{', con token' if token else ''})")
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Servizio HTTP per aggiungere gare all\'archivio')
+    parser.add_argument('--host', default='127.0.0.1', help='indirizzo di ascolto (default: 127.0.0.1)')
+    parser.add_argument('--porta', type=int, default=PORTA, help=f'porta (default: {PORTA})')
+    parser.add_argument('--worker', type=int, default=None, help='processi per parsing e report (default: CPU)')
+    parser.add_argument('--token', default=os.environ.get('INGEST_TOKEN'),
+                        help='token richiesto nelle POST (default: $INGEST_TOKEN)')
+    parser.add_argument('--url', default=NOMINATIM_URL, help='server Nominatim (default: OSM pubblico)')
+    args = parser.parse_args()
+
+    if args.host not in ('127.0.0.1', 'localhost', '::1') and not args.token:
+        print("[WARN] Servizio raggiungibile dalla rete senza --token")
+    try:
+        asyncio.run(serve(args.host, args.porta, args.worker, args.token, args.url))
+    except KeyboardInterrupt:
+        print("\n[*] Servizio fermato.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
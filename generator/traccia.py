@@ -0,0 +1,535 @@
+#!/usr/bin/env python3
+"""
+traccia.py — Modello compatto di una traccia GPX, condiviso dagli script del generatore.
+
+RouteTrack tiene le coordinate in array tipizzati contigui (array('d')) e
+calcola su richiesta le serie derivate (distanza cumulata, quote smussate),
+memorizzandole per gli usi successivi. Dislivello e salite si calcolano sulle
+quote ricampionate a passo fisso di distanza (resampled()): lo stesso percorso
+dà gli stessi numeri sia registrato a 1 s sia esportato da un pianificatore
+con pochi punti. RouteAnalysis raccoglie i numeri di
+riepilogo che finiscono nel JSON della gara.
+
+Uso:
+    from traccia import RouteTrack
+
+    track = RouteTrack.from_gpx(Path("gara.gpx"))
+    track.cum_dist[-1]          # metri totali
+    track.analyze().as_dict()   # {'distanza_km': ..., 'dislivello_m': ..., ...}
+"""
+
+import math
+from array import array
+from xml.parsers import expat
+from pathlib import Path
+
+R_TERRA = 6371000   # raggio medio terrestre (m), lo stesso usato dal template JS
+
+# Da incrementare quando cambia il calcolo di RouteTrack.analyze():
+# invalida cache e verdetti salvati dagli strumenti che ne dipendono.
+ANALYSIS_VERSION = 4
+
+PARSE_CHUNK = 64 * 1024   # byte letti per volta dal file GPX
+
+PASSO_GRIGLIA_M = 10      # passo della griglia di ricampionamento delle quote
+# Ampiezza della media mobile sulle quote ricampionate. Con 250 m un circuito
+# piatto registrato a 1 s, lo stesso percorso esportato da un pianificatore e la
+# traccia originale danno lo stesso D+ a pochi metri, e restano vicini ai valori
+# delle vecchie tracce (la finestra da 50 m lasciava passare il rumore barometrico).
+SMUSSO_M        = 250
+
+# Rilevamento salite, con gli stessi parametri di findClimbs() nel template
+SALITA_SEZIONE_M     = 50    # lunghezza di una sezione (multiplo di PASSO_GRIGLIA_M)
+SALITA_MIN_SEZIONI   = 7     # sezioni oltre la prima perché sia una salita
+SALITA_PENDENZA_MIN  = 3     # % per iniziare una salita
+SALITA_PENDENZA_FINE = 1     # % sotto cui la salita finisce
+SALITA_MAX_PAUSA     = 5     # sezioni di distacco entro cui due salite si uniscono
+SALITA_MIN_DIFFICOLTA = 20   # pendenza_media² × km
+
+# Soglie di difficoltà ed etichette, come getDifficultyLabel() nel template
+LIVELLI_SALITA = ((75, 'Facile'), (150, 'Moderata'), (300, 'Impegnativa'),
+                  (600, 'Difficile'), (900, 'Estrema'), (1200, 'HC'))
+LIVELLO_MASSIMO = 'Leggendaria'
+
+
+def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Distanza in metri tra due punti (lat/lon in gradi)."""
+    φ1, φ2 = math.radians(lat1), math.radians(lat2)
+    dφ = math.radians(lat2 - lat1)
+    dλ = math.radians(lon2 - lon1)
+    a = math.sin(dφ/2)**2 + math.cos(φ1)*math.cos(φ2)*math.sin(dλ/2)**2
+    return R_TERRA * 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+
+
+# ── TRACCIA ───────────────────────────────────────────────────────────────────
+
+class RouteTrack:
+    """
+    Traccia GPX come colonne parallele lat/lon/ele (array('d')).
+
+    Le quote mancanti sono NaN. Le serie derivate vengono calcolate al primo
+    accesso e tenute in cache sull'istanza: la traccia è da considerarsi
+    immutabile dopo la costruzione.
+    """
+
+    __slots__ = ('lat', 'lon', 'ele', '_cache')
+
+    def __init__(self, lat: array, lon: array, ele: array):
+        if not (len(lat) == len(lon) == len(ele)):
+            raise ValueError("lat, lon ed ele devono avere la stessa lunghezza")
+        self.lat = lat
+        self.lon = lon
+        self.ele = ele
+        self._cache = {}
+
+    # ── costruzione ──
+
+    @classmethod
+    def from_gpx(cls, gpx_path: Path) -> 'RouteTrack':
+        """Legge i trkpt (o in mancanza i rtept) da un file GPX, a blocchi."""
+        with open(gpx_path, 'rb') as f:
+            return cls._parse(iter(lambda: f.read(PARSE_CHUNK), b''))
+
+    @classmethod
+    def from_string(cls, gpx_text: str | bytes) -> 'RouteTrack':
+        if isinstance(gpx_text, str):
+            gpx_text = gpx_text.encode('utf-8')
+        return cls._parse([gpx_text])
+
+    @classmethod
+    def _parse(cls, chunks) -> 'RouteTrack':
+        """
+        Parsing in streaming con expat: nessun albero XML in memoria, solo le
+        colonne finali. La quota è il primo <ele> figlio diretto del punto (non
+        quelli dentro <extensions>). I punti con lat/lon/ele non numerici vengono saltati.
+        """
+        cols = {'trkpt': (array('d'), array('d'), array('d')),
+                'rtept': (array('d'), array('d'), array('d'))}
+        cur = {}          # punto in lettura: tag, lat, lon, ele
+        ele_text = None   # testo di <ele> in accumulo
+        depth = 0         # livello dentro il punto in lettura (1 = figlio diretto)
+
+        def local(name):
+            return name.rsplit(' ', 1)[-1]
+
+        def start(name, attrs):
+            nonlocal ele_text, depth
+            tag = local(name)
+            if tag in cols and not cur:
+                cur.update(tag=tag, lat=attrs.get('lat'), lon=attrs.get('lon'), ele=None)
+                depth = 0
+            elif cur:
+                depth += 1
+                if tag == 'ele' and depth == 1 and cur['ele'] is None:
+                    ele_text = []
+
+        def chars(data):
+            if ele_text is not None:
+                ele_text.append(data)
+
+        def end(name):
+            nonlocal ele_text, depth
+            tag = local(name)
+            if cur and depth > 0:
+                if tag == 'ele' and ele_text is not None:
+                    cur['ele'] = ''.join(ele_text)
+                    ele_text = None
+                depth -= 1
+            elif cur and tag == cur['tag']:
+                try:
+                    la = float(cur['lat'])
+                    lo = float(cur['lon'])
+                    el = float(cur['ele']) if cur['ele'] is not None else math.nan
+                except (TypeError, ValueError):
+                    pass
+                else:
+                    lat, lon, ele = cols[tag]
+                    lat.append(la)
+                    lon.append(lo)
+                    ele.append(el)
+                cur.clear()
+
+        parser = expat.ParserCreate(namespace_separator=' ')
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        parser.CharacterDataHandler = chars
+        parser.buffer_text = True
+        for chunk in chunks:
+            parser.Parse(chunk, False)
+        parser.Parse(b'', True)
+
+        lat, lon, ele = cols['trkpt'] if len(cols['trkpt'][0]) else cols['rtept']
+        return cls(lat, lon, ele)
+
+    def __len__(self) -> int:
+        return len(self.lat)
+
+    def __repr__(self) -> str:
+        return f"<RouteTrack {len(self)} punti>"
+
+    def _memo(self, key, compute):
+        try:
+            return self._cache[key]
+        except KeyError:
+            value = self._cache[key] = compute()
+            return value
+
+    # ── serie derivate ──
+
+    @property
+    def cum_dist(self) -> array:
+        """Distanza cumulata (m) per ogni punto; cum_dist[0] == 0."""
+        def compute():
+            lat, lon = self.lat, self.lon
+            out = array('d', [0.0]) if len(lat) else array('d')
+            tot = 0.0
+            for i in range(1, len(lat)):
+                tot += haversine(lat[i-1], lon[i-1], lat[i], lon[i])
+                out.append(tot)
+            return out
+        return self._memo('cum_dist', compute)
+
+    @property
+    def valid_ele(self) -> array:
+        """Quote dei soli punti che ne hanno una (NaN esclusi)."""
+        return self._memo('valid_ele', lambda: array('d', (e for e in self.ele if e == e)))
+
+    @property
+    def filled_ele(self) -> array:
+        """
+        Quote con quelle mancanti (NaN) prese dall'ultima nota, o dalla prima per
+        i punti iniziali (0 se la traccia non ne ha): per le serie punto per punto
+        di report e mappa, che altrimenti avrebbero finti scalini a 0 m.
+        """
+        def compute():
+            if all(e == e for e in self.ele):
+                return self.ele
+            valid = self.valid_ele
+            last = valid[0] if valid else 0.0
+            out = array('d')
+            for e in self.ele:
+                if e == e:
+                    last = e
+                out.append(last)
+            return out
+        return self._memo('filled_ele', compute)
+
+    def resampled(self, step: float = PASSO_GRIGLIA_M) -> tuple[array, array, array]:
+        """
+        Quote interpolate linearmente su una griglia di distanza a passo `step` (m).
+
+        Un solo passaggio sui punti con quota (i NaN sono saltati): nodi a
+        0, step, 2·step, … più un nodo finale alla distanza totale. Prima del
+        primo e dopo l'ultimo punto con quota la quota resta costante.
+        Ritorna (dist, ele, index): index è il punto originale più vicino a
+        ogni nodo, per riportare sulla traccia ciò che si trova sulla griglia.
+        Vuote se la traccia non ha quote.
+        """
+        def compute():
+            dist, total = self.cum_dist, (self.cum_dist[-1] if len(self) else 0.0)
+            gd, ge, gi = array('d'), array('d'), array('i')
+            k = 0
+            prev = None
+            for i, e in enumerate(self.ele):
+                if e != e:
+                    continue
+                d = dist[i]
+                while k * step <= d:
+                    g = k * step
+                    if prev is None:
+                        node = (e, i)
+                    else:
+                        pd, pe, pi = prev
+                        t = (g - pd) / (d - pd)       # g > pd: i nodi fino a pd sono già emessi
+                        node = (pe + t * (e - pe), i if t >= 0.5 else pi)
+                    gd.append(g)
+                    ge.append(node[0])
+                    gi.append(node[1])
+                    k += 1
+                prev = (d, e, i)
+            if prev is None:
+                return gd, ge, gi
+            _, pe, pi = prev
+            tail = [k * step for k in range(k, math.floor(total / step) + 1)]
+            if (tail[-1] if tail else gd[-1]) < total:
+                tail.append(total)
+            gd.extend(tail)
+            ge.extend([pe] * len(tail))
+            gi.extend([pi] * len(tail))
+            return gd, ge, gi
+        return self._memo(('resampled', step), compute)
+
+    def smoothed_ele(self, window_m: float = SMUSSO_M) -> array:
+        """Media mobile centrata su `window_m` metri delle quote ricampionate, contro il rumore GPS."""
+        def compute():
+            eles = self.resampled()[1]
+            n = len(eles)
+            half = round(window_m / PASSO_GRIGLIA_M) // 2
+            # Somme prefisse: ogni finestra costa O(1)
+            prefix = array('d', [0.0])
+            for e in eles:
+                prefix.append(prefix[-1] + e)
+            out = array('d')
+            for i in range(n):
+                start = max(0, i - half)
+                end   = min(n, i + half + 1)
+                out.append((prefix[end] - prefix[start]) / (end - start))
+            return out
+        return self._memo(('smoothed_ele', window_m), compute)
+
+    def elevation_gain(self, window_m: float = SMUSSO_M) -> float:
+        """Dislivello positivo (m) sulle quote ricampionate e smussate."""
+        def compute():
+            eles = self.smoothed_ele(window_m)
+            d_plus = 0.0
+            for i in range(1, len(eles)):
+                diff = eles[i] - eles[i-1]
+                if diff > 0:
+                    d_plus += diff
+            return d_plus
+        return self._memo(('elevation_gain', window_m), compute)
+
+    def range_index(self) -> dict:
+        """
+        Somme prefisse per rispondere in O(1) alle statistiche di un tratto [i0, i1]:
+          dist  distanza cumulata (m)
+          gain  dislivello positivo cumulato (m, quote grezze)
+          loss  dislivello negativo cumulato (m, positivo)
+          ele   somma cumulata delle quote (quota media = Δele / (i1 - i0))
+        Come nel template JS, una quota mancante è l'ultima nota (filled_ele).
+        """
+        def compute():
+            gain, loss, ele_sum = array('d'), array('d'), array('d')
+            g = l = s = 0.0
+            prev = None
+            for e in self.filled_ele:
+                if prev is not None:
+                    diff = e - prev
+                    if diff > 0:
+                        g += diff
+                    else:
+                        l -= diff
+                s += e
+                gain.append(g)
+                loss.append(l)
+                ele_sum.append(s)
+                prev = e
+            return {'dist': self.cum_dist, 'gain': gain, 'loss': loss, 'ele': ele_sum}
+        return self._memo('range_index', compute)
+
+    def gradient_runs(self, window: int = 6) -> tuple[array, array]:
+        """
+        Tratti consecutivi con la stessa classe di pendenza, per colorare la mappa.
+
+        Come nel template JS: pendenza grezza di ogni segmento (quote di
+        filled_ele), media su ±`window` punti, classe = pendenza arrotondata all'1%
+        e limitata a ±20. Il segmento i (dal punto i-1 al punto i) prende la
+        classe del punto i.
+
+        Ritorna (start, cls): il tratto k va dal punto start[k] al punto
+        start[k+1] (o all'ultimo punto) ed è di classe cls[k].
+        """
+        def compute():
+            n = len(self)
+            dist = self.cum_dist
+            ele = self.filled_ele
+            prefix = array('d', [0.0, 0.0])    # il punto 0 ha pendenza 0
+            for i in range(1, n):
+                seg = dist[i] - dist[i-1]
+                g = (ele[i] - ele[i-1]) / seg * 100 if seg > 0 else 0.0
+                prefix.append(prefix[-1] + g)
+
+            start, cls = array('i'), array('i')
+            for i in range(1, n):
+                lo = max(0, i - window)
+                hi = min(n - 1, i + window)
+                g = (prefix[hi + 1] - prefix[lo]) / (hi - lo + 1)
+                c = max(-20, min(20, math.floor(g + 0.5)))   # come Math.round
+                if not cls or cls[-1] != c:
+                    start.append(i - 1)
+                    cls.append(c)
+            return start, cls
+        return self._memo(('gradient_runs', window), compute)
+
+    def lttb(self, threshold: int) -> array:
+        """
+        Indici dei punti scelti dal sottocampionamento Largest-Triangle-Three-Buckets
+        della serie quota/distanza (quote di filled_ele, come nel template JS).
+        Primo e ultimo punto sono sempre inclusi; se la traccia ha già al più
+        `threshold` punti li ritorna tutti.
+        """
+        def compute():
+            n = len(self)
+            if threshold >= n or threshold < 3:
+                return array('i', range(n))
+            x = self.cum_dist
+            y = self.filled_ele
+            every = (n - 2) / (threshold - 2)
+            out = array('i', [0])
+            a = 0
+            for i in range(threshold - 2):
+                # Media del bucket successivo
+                avg_start = math.floor((i + 1) * every) + 1
+                avg_end = min(math.floor((i + 2) * every) + 1, n)
+                avg_x = avg_y = 0.0
+                for j in range(avg_start, avg_end):
+                    avg_x += x[j]
+                    avg_y += y[j]
+                avg_x /= avg_end - avg_start
+                avg_y /= avg_end - avg_start
+                # Punto del bucket corrente che forma il triangolo più grande
+                best, best_area = avg_start - 1, -1.0
+                for j in range(math.floor(i * every) + 1, avg_start):
+                    area = abs((x[a] - avg_x) * (y[j] - y[a]) - (x[a] - x[j]) * (avg_y - y[a]))
+                    if area > best_area:
+                        best, best_area = j, area
+                out.append(best)
+                a = best
+            out.append(n - 1)
+            return out
+        return self._memo(('lttb', threshold), compute)
+
+    def climbs(self) -> list['Climb']:
+        """
+        Salite della traccia, con lo stesso algoritmo del template JS
+        (findClimbs), quindi gli stessi risultati del report: la griglia di
+        resampled() è divisa in sezioni di SALITA_SEZIONE_M metri, una salita
+        inizia su una sezione ≥ SALITA_PENDENZA_MIN % e finisce alla prima
+        < SALITA_PENDENZA_FINE %; salite vicine si uniscono e restano quelle
+        abbastanza difficili. Distanze e dislivelli sono quelli della griglia,
+        gli indici quelli dei punti originali più vicini.
+        """
+        def compute():
+            dist, ele, index = self.resampled()
+            m = len(dist)
+            per = max(1, round(SALITA_SEZIONE_M / PASSO_GRIGLIA_M))
+
+            # Sezioni: (nodo iniziale, nodo finale, pendenza %); l'ultima può essere più corta
+            sections = []
+            for cur in range(0, m - 1, per):
+                end = min(cur + per, m - 1)
+                d = dist[end] - dist[cur]
+                sections.append((cur, end, (ele[end] - ele[cur]) / d * 100 if d > 0 else 0.0))
+
+            # Salite come intervalli di sezioni [primo, ultimo]
+            spans = []
+            first = None
+            last_idx = len(sections) - 1
+            for k, (_, _, grade) in enumerate(sections):
+                if first is None and grade >= SALITA_PENDENZA_MIN:
+                    first = k
+                elif first is not None and (grade < SALITA_PENDENZA_FINE or k == last_idx):
+                    if k - 1 - first >= SALITA_MIN_SEZIONI:
+                        spans.append([first, k - 1])
+                    first = None
+
+            merged = []
+            for span in spans:
+                if merged and span[0] - merged[-1][1] <= SALITA_MAX_PAUSA:
+                    merged[-1][1] = span[1]
+                else:
+                    merged.append(span)
+
+            out = []
+            for first, last in merged:
+                i0, i1 = sections[first][0], sections[last][1]
+                d = dist[i1] - dist[i0]
+                gain = ele[i1] - ele[i0]
+                avg = gain / d * 100
+                difficulty = avg ** 2 * (d / 1000)
+                if difficulty < SALITA_MIN_DIFFICOLTA:
+                    continue
+                max_grade = max(0.0, max(sections[k][2] for k in range(first, last + 1)))
+                out.append(Climb(index[i0], index[i1], dist[i0], dist[i1],
+                                 gain, avg, max_grade, difficulty))
+            return out
+        return self._memo('climbs', compute)
+
+    @property
+    def center(self) -> tuple[float, float] | None:
+        """Punto centrale della traccia (per indice), usato per il geocoding."""
+        if not len(self):
+            return None
+        mid = len(self) // 2
+        return self.lat[mid], self.lon[mid]
+
+    def set_analysis(self, analysis: 'RouteAnalysis'):
+        """Imposta il riepilogo già noto (es. dalla cache delle tracce): analyze() lo ritorna."""
+        self._cache['analysis'] = analysis
+
+    def analyze(self) -> 'RouteAnalysis':
+        """Riepilogo della traccia (memorizzato)."""
+        def compute():
+            if not len(self):
+                return RouteAnalysis()
+            d_plus = self.elevation_gain()
+            center_lat, center_lon = self.center
+            return RouteAnalysis(
+                distanza_km=round(self.cum_dist[-1] / 1000, 2),
+                dislivello_m=round(d_plus) if d_plus > 0 else None,
+                center_lat=center_lat,
+                center_lon=center_lon,
+            )
+        return self._memo('analysis', compute)
+
+
+# ── ANALISI ───────────────────────────────────────────────────────────────────
+
+class RouteAnalysis:
+    """Numeri di riepilogo di una traccia. None = non disponibile."""
+
+    __slots__ = ('distanza_km', 'dislivello_m', 'center_lat', 'center_lon')
+
+    def __init__(self, distanza_km: float | None = None, dislivello_m: int | None = None,
+                 center_lat: float | None = None, center_lon: float | None = None):
+        self.distanza_km  = distanza_km
+        self.dislivello_m = dislivello_m
+        self.center_lat   = center_lat
+        self.center_lon   = center_lon
+
+    def as_dict(self) -> dict:
+        """Forma storica restituita da parse_gpx()."""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self) -> str:
+        return f"<RouteAnalysis {self.distanza_km} km, +{self.dislivello_m} m>"
+
+
+# ── SALITE ────────────────────────────────────────────────────────────────────
+
+def climb_level(difficulty: float) -> str:
+    """Etichetta di difficoltà di una salita (Facile … Leggendaria)."""
+    for limit, label in LIVELLI_SALITA:
+        if difficulty < limit:
+            return label
+    return LIVELLO_MASSIMO
+
+
+class Climb:
+    """Una salita: punti estremi, distanze in metri, pendenze in %."""
+
+    __slots__ = ('start_index', 'end_index', 'start_m', 'end_m',
+                 'dislivello_m', 'pendenza_media', 'pendenza_max', 'difficolta')
+
+    def __init__(self, start_index: int, end_index: int, start_m: float, end_m: float,
+                 dislivello_m: float, pendenza_media: float, pendenza_max: float, difficolta: float):
+        self.start_index    = start_index
+        self.end_index      = end_index
+        self.start_m        = start_m
+        self.end_m          = end_m
+        self.dislivello_m   = dislivello_m
+        self.pendenza_media = pendenza_media
+        self.pendenza_max   = pendenza_max
+        self.difficolta     = difficolta
+
+    @property
+    def lunghezza_m(self) -> float:
+        return self.end_m - self.start_m
+
+    @property
+    def livello(self) -> str:
+        return climb_level(self.difficolta)
+
+    def __repr__(self) -> str:
+        return (f"<Climb km {self.start_m / 1000:.1f}-{self.end_m / 1000:.1f}, "
+                f"{self.pendenza_media:.1f}% ({self.livello})>")
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+verifica_archivio.py — Controlla la coerenza dell'archivio gare.
+
+Uso:
+    python generator/verifica_archivio.py              # verifica completa
+    python generator/verifica_archivio.py --rigoroso   # anche gli avvisi fanno fallire
+    python generator/verifica_archivio.py --no-cache   # ignora i verdetti salvati
+
+Controlli:
+  - ogni gare-sorgenti/<slug>.json ha public/gpx/<slug>.gpx e public/gare/<slug>.html
+  - il campo `slug` coincide con il nome file ed è unico nell'archivio
+  - `distanza_km` / `dislivello_m` corrispondono al GPX (ammessi più giri del circuito)
+  - GPX/HTML orfani (senza JSON)
+  - differenze tra gare-sorgenti/ e generator/gare-sorgenti/
+
+Il confronto con il GPX gira in un pool di processi; il verdetto di ogni
+coppia JSON+GPX è salvato in .cache/verifica.json con l'hash del contenuto,
+così i giri successivi rileggono solo i file cambiati.
+
+Exit code 0 se non ci sono errori, 1 altrimenti.
+"""
+
+import os
+import sys
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from traccia import ANALYSIS_VERSION
+from cache_tracce import cached_analysis
+from archivio_io import write_text_atomic
+
+ARCHIVIO_DIR = Path(__file__).parent.parent
+JSON_DIR     = ARCHIVIO_DIR / 'gare-sorgenti'
+ALT_JSON_DIR = ARCHIVIO_DIR / 'generator' / 'gare-sorgenti'
+GPX_DIR      = ARCHIVIO_DIR / 'public' / 'gpx'
+HTML_DIR     = ARCHIVIO_DIR / 'public' / 'gare'
+CACHE_PATH   = ARCHIVIO_DIR / '.cache' / 'verifica.json'
+
+CHECK_VERSION = 1      # da incrementare quando cambiano i controlli su JSON+GPX
+CAMPI_OBBLIGATORI = ('slug', 'titolo', 'data')
+MAX_GIRI = 50          # come lo Spinbox "Giri del circuito" di genera_report
+
+
+# ── CONFRONTO CON IL GPX (eseguito nei worker) ────────────────────────────────
+
+def _lap_factor(stored: float, parsed: float) -> int | None:
+    """Numero di giri k per cui stored ≈ k × parsed (tolleranza 1%, min 0.1 km)."""
+    for k in range(1, MAX_GIRI + 1):
+        expected = parsed * k
+        if abs(stored - expected) <= max(0.1, expected * 0.01):
+            return k
+    return None
+
+
+def check_stats(gara: dict, gpx_path: str) -> list[str]:
+    """Problemi tra i numeri salvati nel JSON e quelli ricalcolati dal GPX."""
+    try:
+        analysis = cached_analysis(Path(gpx_path))
+    except Exception as e:
+        return [f"GPX illeggibile ({e})"]
+    if analysis.distanza_km is None:
+        return ["GPX senza punti"]
+
+    problems = []
+    giri = 1
+    km = gara.get('distanza_km')
+    if km is not None:
+        giri = _lap_factor(float(km), analysis.distanza_km)
+        if giri is None:
+            problems.append(f"distanza_km {km} ≠ GPX {analysis.distanza_km} (né suoi multipli)")
+            giri = 1
+
+    d_plus = gara.get('dislivello_m')
+    if d_plus is not None and analysis.dislivello_m is not None:
+        expected = analysis.dislivello_m * giri
+        if abs(float(d_plus) - expected) > max(15, expected * 0.10):
+            problems.append(f"dislivello_m {d_plus} ≠ GPX {expected}"
+                            + (f" ({giri} giri)" if giri > 1 else ""))
+    return problems
+
+
+def _check_job(job: tuple) -> tuple[str, list[str]]:
+    key, gara, gpx_path = job
+    return key, check_stats(gara, gpx_path)
+
+
+# ── CACHE VERDETTI ────────────────────────────────────────────────────────────
+
+def _digest(*paths: Path) -> str:
+    h = hashlib.sha256(f"{CHECK_VERSION}:{ANALYSIS_VERSION}".encode())
+    for p in paths:
+        h.update(p.read_bytes())
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def load_cache() -> dict:
+    try:
+        return json.loads(CACHE_PATH.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(cache: dict):
+    write_text_atomic(CACHE_PATH, json.dumps(cache, ensure_ascii=False, sort_keys=True))
+
+
+# ── VERIFICA ──────────────────────────────────────────────────────────────────
+
+def _load_json_dir(json_dir: Path) -> dict[str, dict | None]:
+    """{stem: gara} — None se il file non è JSON valido o non contiene un oggetto."""
+    out = {}
+    if not json_dir.exists():
+        return out
+    for p in sorted(json_dir.glob('*.json')):
+        try:
+            gara = json.loads(p.read_text(encoding='utf-8'))
+        except ValueError:
+            gara = None
+        out[p.stem] = gara if isinstance(gara, dict) else None
+    return out
+
+
+def verify_archive(use_cache: bool = True, workers: int | None = None) -> tuple[dict, dict]:
+    """Ritorna ({slug: [errori]}, {ambito: [avvisi]})."""
+    errors: dict[str, list[str]] = {}
+    warnings: dict[str, list[str]] = {}
+    gare = _load_json_dir(JSON_DIR)
+
+    # Struttura, file collegati e unicità degli slug
+    seen: dict[str, str] = {}
+    jobs = []
+    cache = load_cache() if use_cache else {}
+    verdicts: dict[str, list[str]] = {}
+    keys: dict[str, str] = {}
+
+    for stem, gara in gare.items():
+        problems = errors.setdefault(stem, [])
+        if gara is None:
+            problems.append("JSON non valido")
+            continue
+        for campo in CAMPI_OBBLIGATORI:
+            if not gara.get(campo):
+                problems.append(f"campo '{campo}' mancante")
+        slug = gara.get('slug') or stem
+        if slug != stem:
+            problems.append(f"slug '{slug}' diverso dal nome file")
+        if slug in seen:
+            problems.append(f"slug '{slug}' duplicato (anche in {seen[slug]}.json)")
+        seen.setdefault(slug, stem)
+
+        gpx_path = GPX_DIR / f"{stem}.gpx"
+        if not (HTML_DIR / f"{stem}.html").exists():
+            problems.append("report HTML mancante")
+        if not gpx_path.exists():
+            problems.append("GPX mancante")
+            continue
+
+        key = _digest(JSON_DIR / f"{stem}.json", gpx_path)
+        keys[stem] = key
+        if key in cache:
+            verdicts[key] = cache[key]
+        else:
+            jobs.append((key, gara, str(gpx_path)))
+
+    # Ricalcolo dal GPX solo per le coppie nuove o cambiate
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for key, problems in pool.map(_check_job, jobs, chunksize=max(1, len(jobs) // 32)):
+                verdicts[key] = problems
+    for stem, key in keys.items():
+        errors[stem].extend(verdicts[key])
+
+    if use_cache:
+        save_cache({k: verdicts[k] for k in keys.values()})
+
+    # File orfani
+    for folder, ext in ((GPX_DIR, 'gpx'), (HTML_DIR, 'html')):
+        if folder.exists():
+            for p in sorted(folder.glob(f'*.{ext}')):
+                if p.stem not in gare:
+                    warnings.setdefault(p.stem, []).append(f"{ext.upper()} senza JSON in gare-sorgenti/")
+
+    # Deriva tra le due cartelle gare-sorgenti
+    alt = _load_json_dir(ALT_JSON_DIR)
+    drift = warnings.setdefault('generator/gare-sorgenti', [])
+    for stem in sorted(alt.keys() - gare.keys()):
+        drift.append(f"{stem}.json presente solo in generator/gare-sorgenti/")
+    for stem in sorted(gare.keys() & alt.keys()):
+        if gare[stem] != alt[stem]:
+            a, b = gare[stem] or {}, alt[stem] or {}
+            diff = sorted(k for k in a.keys() | b.keys() if a.get(k) != b.get(k))
+            drift.append(f"{stem}.json differisce ({', '.join(diff) or 'JSON non valido'})")
+
+    return ({k: v for k, v in errors.items() if v}, {k: v for k, v in warnings.items() if v})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verifica la coerenza dell'archivio gare")
+    parser.add_argument('--rigoroso', action='store_true', help='considera errori anche gli avvisi')
+    parser.add_argument('--no-cache', action='store_true', help='ricalcola tutti i verdetti')
+    parser.add_argument('--workers', type=int, default=None, help='processi per il parsing GPX (default: CPU)')
+    args = parser.parse_args()
+
+    if not JSON_DIR.exists():
+        print(f"[FAIL] Cartella gare-sorgenti non trovata: {JSON_DIR}")
+        return 1
+
+    if args.workers is not None and args.workers < 1:
+        print("[FAIL] --workers deve essere almeno 1")
+        return 1
+    workers = args.workers or os.cpu_count() or 1
+
+    print(f"[*] Verifica archivio ({len(list(JSON_DIR.glob('*.json')))} gare, {workers} worker)...")
+    errors, warnings = verify_archive(use_cache=not args.no_cache, workers=workers)
+
+    for slug, problems in sorted(errors.items()):
+        for p in problems:
+            print(f"  [FAIL] {slug}: {p}")
+    for scope, problems in sorted(warnings.items()):
+        for p in problems:
+            print(f"  [WARN] {scope}: {p}")
+
+    n_err = sum(len(v) for v in errors.values())
+    n_warn = sum(len(v) for v in warnings.values())
+    print(f"\n[*] Risultato: {n_err} errori, {n_warn} avvisi")
+    if n_err or (args.rigoroso and n_warn):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())